@@ -0,0 +1,10 @@
+import pytest
+
+from core.testing import isolated_environment
+
+
+@pytest.fixture(autouse=True, scope='session')
+def isolated_directories():
+    """То же, что core.testing.TestRunner, при запуске через pytest."""
+    with isolated_environment():
+        yield
@@ -0,0 +1,295 @@
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import (
+    FileBasedCache as BaseFileBasedCache,
+)
+from django.core.files import locks
+from django.utils.module_loading import import_string
+
+from . import instrumentation
+
+GENERATION_KEY = 'tiered:generation:{}'
+NAMESPACE_RE = re.compile(r'[\w-]*')
+MISSING = object()
+
+
+def namespace(key):
+    """Пространство ключа: начало до первого двоеточия, например page_cache
+    у page_cache:index_page:…"""
+    return NAMESPACE_RE.match(key)[0]
+
+
+class FileBasedCache(BaseFileBasedCache):
+    """Файловый кэш, у которого add и incr атомарны между процессами.
+
+    Обе операции идут под блокировкой файла в каталоге кэша; у
+    встроенного бэкенда это чтение и запись по отдельности, и
+    одновременные incr теряются.
+    """
+
+    def _locked(self):
+        self._createdir()
+        lock = open(os.path.join(self._dir, '.lock'), 'wb')
+        locks.lock(lock, locks.LOCK_EX)
+        return lock
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._locked():
+            return super().incr(key, delta, version)
+
+
+class LRUStore:
+    """Небольшое LRU-хранилище процесса со сроком жизни записей."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            value, expires, _ = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout, group=None):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout, group)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard(self, group):
+        """Удаляет все записи группы."""
+        with self._lock:
+            for key in [
+                key for key, entry in self._data.items() if entry[2] == group
+            ]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кэш: L1 в памяти процесса перед общим L2.
+
+    L2 — любой бэкенд Django из OPTIONS['L2'] с атомарным incr
+    (FileBasedCache отсюда на одной машине, memcached на нескольких).
+    У каждого пространства ключей (см. namespace) свой счётчик поколений
+    в L2, и запись увеличивает только его. Процесс сверяет счётчики
+    знакомых ему пространств одним get_many не чаще раза в SYNC_INTERVAL
+    секунд и выбрасывает из L1 записи тех, в которые писал кто-то другой.
+    Даже если сверка опоздала, запись живёт в L1 не дольше L1_TIMEOUT
+    секунд.
+
+    Пространства из STABLE_NAMESPACES не сверяются: значение под их
+    ключами не меняется (в ключ карточки входят версии) или проверяется
+    при чтении (ETag в записи кэша страниц).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        l2 = dict(options['L2'])
+        backend = import_string(l2.pop('BACKEND'))
+        self.l2 = backend(l2.pop('LOCATION', ''), l2)
+        self.l1 = LRUStore(options.get('L1_MAX_ENTRIES', 1000))
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.sync_interval = options.get('SYNC_INTERVAL', 1)
+        self.stable = frozenset(options.get('STABLE_NAMESPACES', ()))
+        self._generations = {}
+        self._synced_at = 0
+        self.stats = dict.fromkeys(
+            ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses'), 0
+        )
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['l1_entries'] = len(self.l1)
+        return stats
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        if not self._generations:
+            return
+        keys = {
+            GENERATION_KEY.format(space): space
+            for space in self._generations
+        }
+        current = self.l2.get_many(keys)
+        for key, space in keys.items():
+            generation = current.get(key)
+            if generation != self._generations[space]:
+                self.l1.discard(space)
+                self._generations[space] = generation
+
+    def _watch(self, space):
+        """Запоминает поколение пространства до первого чтения из L2,
+        чтобы запись, сделанная после него, не осталась незамеченной."""
+        if space not in self._generations and space not in self.stable:
+            self._generations[space] = self.l2.get(
+                GENERATION_KEY.format(space)
+            )
+
+    def _bump(self, space):
+        """Сообщает остальным процессам, что их записи пространства в L1
+        устарели."""
+        if space in self.stable:
+            return
+        key = GENERATION_KEY.format(space)
+        # Счётчик начинается со времени: вытесненный и созданный заново,
+        # он не повторит значение, которое процессы уже видели.
+        self.l2.add(key, time.time_ns(), None)
+        try:
+            generation = self.l2.incr(key)
+        except ValueError:
+            return
+        known = self._generations.get(space)
+        if known is None or generation != known + 1:
+            # Между нашими записями писал кто-то ещё.
+            self.l1.discard(space)
+        self._generations[space] = generation
+
+    def _l1_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def _remember(self, key, value, timeout, version):
+        self.l1.set(
+            self.make_key(key, version), value, self._l1_timeout(timeout),
+            namespace(key),
+        )
+
+    def _bump_keys(self, keys):
+        for space in {namespace(key) for key in keys}:
+            self._bump(space)
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        value = self.l1.get(self.make_key(key, version))
+        if value is not MISSING:
+            self.stats['l1_hits'] += 1
+            instrumentation.count('cache_hits')
+            return value
+        self.stats['l1_misses'] += 1
+        self._watch(namespace(key))
+        value = self.l2.get(key, MISSING, version=version)
+        if value is MISSING:
+            self.stats['l2_misses'] += 1
+            instrumentation.count('cache_misses')
+            return default
+        self.stats['l2_hits'] += 1
+        instrumentation.count('cache_hits')
+        self._remember(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.l1.get(self.make_key(key, version))
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        self.stats['l1_hits'] += len(found)
+        self.stats['l1_misses'] += len(missing)
+        misses = len(missing)
+        if missing:
+            for space in {namespace(key) for key in missing}:
+                self._watch(space)
+            fetched = self.l2.get_many(missing, version=version)
+            misses -= len(fetched)
+            self.stats['l2_hits'] += len(fetched)
+            self.stats['l2_misses'] += misses
+            for key, value in fetched.items():
+                self._remember(key, value, DEFAULT_TIMEOUT, version)
+            found.update(fetched)
+        instrumentation.count('cache_hits', len(found))
+        instrumentation.count('cache_misses', misses)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        self._bump(namespace(key))
+        self._remember(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version)
+        self._bump_keys(data)
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self._bump(namespace(key))
+            self._remember(key, value, timeout, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self._bump(namespace(key))
+        self._remember(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def delete(self, key, version=None):
+        self.l2.delete(key, version=version)
+        self.l1.delete(self.make_key(key, version))
+        self._bump(namespace(key))
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        for key in keys:
+            self.l1.delete(self.make_key(key, version))
+        self._bump_keys(keys)
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def clear(self):
+        # Счётчики поколений пропадут вместе с L2, и остальные процессы
+        # увидят это при сверке.
+        self.l2.clear()
+        self.l1.clear()
+        self._generations = {}
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
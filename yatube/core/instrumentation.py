@@ -0,0 +1,164 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('perf', default=None)
+
+
+class Collector:
+    """Что успел сделать один запрос: времена по этапам в секундах,
+    счётчики и отметки вроде исхода кэша страницы."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.timings = defaultdict(float)
+        self.counts = Counter()
+        self.marks = {}
+        self._rendering = 0
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings['db'] += time.perf_counter() - started
+            self.counts['db'] += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def fields(self):
+        """Плоский словарь для лога и метрик."""
+        fields = {
+            'total_ms': round(self.elapsed * 1000, 1),
+            'db_queries': self.counts['db'],
+        }
+        for name, seconds in self.timings.items():
+            fields[f'{name}_ms'] = round(seconds * 1000, 1)
+        for name, value in self.counts.items():
+            if name != 'db':
+                fields[name] = value
+        fields.update(self.marks)
+        return fields
+
+    def server_timing(self):
+        metrics = [f'total;dur={self.elapsed * 1000:.1f}']
+        for name, seconds in self.timings.items():
+            metric = f'{name};dur={seconds * 1000:.1f}'
+            if name == 'db':
+                metric += f';desc="{self.counts["db"]} queries"'
+            metrics.append(metric)
+        if self.counts['cache_hits'] or self.counts['cache_misses']:
+            metrics.append(
+                f'cache;desc="{self.counts["cache_hits"]} hits, '
+                f'{self.counts["cache_misses"]} misses"'
+            )
+        for name, value in self.marks.items():
+            metrics.append(f'{name};desc="{value}"')
+        return ', '.join(metrics)
+
+
+def current():
+    return _current.get()
+
+
+def count(name, value=1):
+    collector = _current.get()
+    if collector is not None:
+        collector.counts[name] += value
+
+
+def mark(name, value):
+    collector = _current.get()
+    if collector is not None:
+        collector.marks[name] = value
+
+
+@contextmanager
+def timed(name):
+    collector = _current.get()
+    if collector is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.timings[name] += time.perf_counter() - started
+
+
+class Template(django_backend.Template):
+    """Шаблон, время отрисовки которого попадает в tpl.
+
+    Считается только внешняя отрисовка (render_to_string внутри тегов
+    уже входит в неё) и без SQL, выполненного ленивыми queryset.
+    """
+
+    def render(self, context=None, request=None):
+        collector = _current.get()
+        if collector is None or collector._rendering:
+            return super().render(context, request)
+        collector._rendering += 1
+        started, db = time.perf_counter(), collector.timings['db']
+        try:
+            return super().render(context, request)
+        finally:
+            collector._rendering -= 1
+            collector.timings['tpl'] += (
+                time.perf_counter() - started
+                - (collector.timings['db'] - db)
+            )
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+class ServerTimingMiddleware:
+    """Время SQL, шаблонов, кэша и превью для каждого запроса.
+
+    Итог уходит в заголовок Server-Timing и, при REQUEST_LOG, строкой
+    key=value в лог core.instrumentation. Сам сборщик доступен view и
+    остальным middleware как request.perf.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        collector = request.perf = Collector()
+        token = _current.set(collector)
+        try:
+            with connection.execute_wrapper(collector.execute):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        collector.finish()
+        response['Server-Timing'] = collector.server_timing()
+        if settings.REQUEST_LOG:
+            match = request.resolver_match
+            fields = {
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else '-',
+                'status': response.status_code,
+                **collector.fields(),
+            }
+            logger.info(
+                ' '.join(f'{key}={value}' for key, value in fields.items()),
+                extra={'perf': fields},
+            )
+        return response
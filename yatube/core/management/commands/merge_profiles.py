@@ -0,0 +1,86 @@
+import os
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import PROFILE_RE
+
+
+class Command(BaseCommand):
+    help = (
+        'Складывает стеки профилей запросов в один файл для '
+        'flamegraph.pl или speedscope и печатает самые горячие функции'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir', default=None,
+            help='Каталог профилей, по умолчанию PROFILING_DIR',
+        )
+        parser.add_argument(
+            '--view', nargs='+', metavar='NAME',
+            help='Только профили этих view, например post:main_page',
+        )
+        parser.add_argument(
+            '--min-ms', type=int, default=0,
+            help='Только запросы не короче этого',
+        )
+        parser.add_argument('--output', default='profile.folded')
+        parser.add_argument('--top', type=int, default=20)
+
+    def read(self, directory, views, min_ms):
+        """Складывает стеки подходящих профилей каталога."""
+        stacks = Counter()
+        requests = defaultdict(list)
+        for name in sorted(os.listdir(directory)):
+            match = PROFILE_RE.match(name)
+            if match is None:
+                continue
+            view, ms = match['view'], int(match['ms'])
+            if (views and view not in views) or ms < min_ms:
+                continue
+            requests[view].append((ms, int(match['queries'])))
+            with open(os.path.join(directory, name)) as source:
+                for line in source:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    stacks[stack] += int(count)
+        return stacks, requests
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILING_DIR
+        if not os.path.isdir(directory):
+            raise CommandError(f'Нет каталога {directory}')
+        stacks, requests = self.read(
+            directory, options['view'], options['min_ms']
+        )
+        if not stacks:
+            raise CommandError('Подходящих профилей нет')
+        with open(options['output'], 'w') as output:
+            for stack, count in sorted(stacks.items()):
+                output.write(f'{stack} {count}\n')
+
+        self.stdout.write(f'{"view":>32} {"профилей":>9} '
+                          f'{"худший, мс":>11} {"запросов":>9}')
+        for view, rows in sorted(requests.items()):
+            worst = max(rows)
+            self.stdout.write(
+                f'{view:>32} {len(rows):>9} {worst[0]:>11} {worst[1]:>9}'
+            )
+        self.hottest(stacks, options['top'])
+        self.stdout.write(f'Стеки: {options["output"]}')
+
+    def hottest(self, stacks, top):
+        total = sum(stacks.values())
+        inclusive, own = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        for title, counter in (('Всего', inclusive), ('Собственное', own)):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{title} время, % от {total} снимков'
+            ))
+            for frame, count in counter.most_common(top):
+                self.stdout.write(f'{count / total:>7.1%}  {frame}')
@@ -0,0 +1,332 @@
+import atexit
+import fcntl
+import glob
+import os
+import pickle
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+SIZE_BUCKETS = tuple(2 ** power for power in range(14, 26))
+
+# Сюда складываются значения завершившихся процессов.
+AGGREGATE = 'aggregate.data'
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in pairs
+    ) + '}'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as source:
+            return pickle.load(source)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _write(directory, filename, data):
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, os.path.join(directory, filename))
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def key(self, labels):
+        return self.name, tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, value=1, **labels):
+        self.registry.update(self, self.key(labels), value)
+
+    def empty(self):
+        return 0
+
+    def merge(self, total, value):
+        return total + value
+
+    def exposition(self, value, label_values):
+        labels = _labels(self.labels, label_values)
+        yield f'{self.name}{labels} {_number(value)}'
+
+
+class Histogram(Counter):
+    """Гистограмма с фиксированными границами корзин.
+
+    Хранится как счётчики по корзинам (последняя — +Inf) и сумма;
+    накопленные значения le считаются только при выводе.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        self.registry.update(self, self.key(labels), value)
+
+    def empty(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def add(self, values, value):
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def merge(self, total, values):
+        return [left + right for left, right in zip(total, values)]
+
+    def exposition(self, values, label_values):
+        cumulative = 0
+        bounds = [_number(bound) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, values):
+            cumulative += count
+            labels = _labels(self.labels, label_values, [('le', bound)])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _labels(self.labels, label_values)
+        yield f'{self.name}_sum{labels} {_number(values[-1])}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """Метрики процесса с общим файловым хранилищем.
+
+    Каждый процесс не чаще раза в METRICS_FLUSH_INTERVAL секунд пишет
+    свои значения в отдельный файл METRICS_DIR; вывод складывает файлы
+    всех процессов. Файлы завершившихся процессов при выводе сливаются
+    в один AGGREGATE, чтобы счётчики не убывали при перезапуске
+    воркеров, а каталог не рос.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._flushed_at = 0
+        self.dirty = False
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=LATENCY_BUCKETS):
+        return self._register(
+            Histogram(self, name, documentation, labels, buckets)
+        )
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _process(self):
+        # После fork значения родителя не должны попасть в файл потомка.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.values = {}
+            self.filename = f'{self._pid}-{time.time_ns()}.pickle'
+
+    def update(self, metric, key, value):
+        with self._lock:
+            self._process()
+            self.dirty = True
+            if metric.kind == 'counter':
+                self.values[key] = self.values.get(key, 0) + value
+            else:
+                values = self.values.get(key)
+                if values is None:
+                    values = self.values[key] = metric.empty()
+                metric.add(values, value)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._flushed_at < (
+            settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        with self._lock:
+            self._process()
+            self._flushed_at = now
+            self.dirty = False
+            data = _dumps(self.values)
+        _write(settings.METRICS_DIR, self.filename, data)
+
+    def _merge(self, totals, values):
+        for key, value in values.items():
+            metric = self.metrics.get(key[0])
+            if metric is not None:
+                totals[key] = metric.merge(
+                    totals.get(key, metric.empty()), value
+                )
+
+    def _compact(self, directory, aggregate):
+        """Переносит в aggregate файлы завершившихся процессов.
+
+        Имена перенесённых файлов хранятся в aggregate, пока файлы не
+        удалены: если удаление не случилось, они не сложатся дважды.
+        """
+        dead = {
+            os.path.basename(path)
+            for path in glob.glob(os.path.join(directory, '*.pickle'))
+            if not _alive(int(os.path.basename(path).split('-')[0]))
+        }
+        if not dead:
+            return
+        for name in dead - aggregate['merged']:
+            values = _load(os.path.join(directory, name))
+            if values is not None:
+                self._merge(aggregate['values'], values)
+        aggregate['merged'] = dead
+        _write(directory, AGGREGATE, _dumps(aggregate))
+        for name in dead:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+    def collect(self):
+        """Значения, сложенные по всем процессам."""
+        self.flush(force=True)
+        directory = settings.METRICS_DIR
+        # Вывод из двух процессов сразу не должен слить файлы дважды.
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            aggregate = _load(os.path.join(directory, AGGREGATE)) or {
+                'values': {}, 'merged': set(),
+            }
+            self._compact(directory, aggregate)
+            totals = {}
+            self._merge(totals, aggregate['values'])
+            for path in glob.glob(os.path.join(directory, '*.pickle')):
+                values = _load(path)
+                if values is not None:
+                    self._merge(totals, values)
+        return totals
+
+    def exposition(self):
+        """Все метрики в текстовом формате Prometheus."""
+        totals = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for (_, label_values), values in sorted(
+                (key, value) for key, value in totals.items()
+                if key[0] == name
+            ):
+                lines.extend(metric.exposition(values, label_values))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'yatube_http_requests_total', 'Запросы по view, методу и статусу',
+    ('view', 'method', 'status'),
+)
+LATENCY = registry.histogram(
+    'yatube_http_request_duration_seconds', 'Время ответа по view',
+    ('view',),
+)
+DB_TIME = registry.histogram(
+    'yatube_http_request_db_seconds', 'Время SQL за запрос по view',
+    ('view',),
+)
+DB_QUERIES = registry.counter(
+    'yatube_db_queries_total', 'SQL-запросы по view', ('view',),
+)
+CACHE = registry.counter(
+    'yatube_cache_requests_total', 'Чтения кэша: hit или miss',
+    ('result',),
+)
+PAGE_CACHE = registry.counter(
+    'yatube_page_cache_total', 'Исходы кэша страниц', ('page', 'outcome'),
+)
+UPLOADS = registry.histogram(
+    'yatube_upload_size_bytes', 'Размер загруженных файлов',
+    ('result',), buckets=SIZE_BUCKETS,
+)
+
+
+@atexit.register
+def _flush_on_exit():
+    if registry._pid == os.getpid() and registry.dirty:
+        registry.flush(force=True)
+
+
+class MetricsMiddleware:
+    """Пишет в реестр итоги запроса из request.perf.
+
+    Стоит перед ServerTimingMiddleware, чтобы получить уже
+    законченные замеры.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else '<unmatched>'
+        REQUESTS.inc(
+            view=view, method=request.method, status=response.status_code
+        )
+        perf = getattr(request, 'perf', None)
+        if perf is not None:
+            LATENCY.observe(perf.elapsed, view=view)
+            DB_TIME.observe(perf.timings['db'], view=view)
+            DB_QUERIES.inc(perf.counts['db'], view=view)
+            for result in ('hit', 'miss'):
+                hits = perf.counts[f'cache_{result}s']
+                if hits:
+                    CACHE.inc(hits, result=result)
+            if 'page' in perf.marks:
+                page, outcome = perf.marks['page'].rsplit(':', 1)
+                PAGE_CACHE.inc(page=page, outcome=outcome)
+        registry.flush()
+        return response
@@ -0,0 +1,154 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PROFILE_RE = re.compile(
+    r'^(?P<time>\d{8}T\d{6})-(?P<id>[0-9a-f]+)-(?P<view>.+)'
+    r'-(?P<ms>\d+)ms-(?P<queries>\d+)q\.collapsed$'
+)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[-1]
+    else:
+        filename = os.path.basename(filename)
+    return f'{filename}:{code.co_name}'
+
+
+def collapse(frame, stop=None):
+    """Стек от корня к листу в формате flamegraph.pl: a;b;c.
+
+    Кадры выше stop (сервер и внешние middleware) отбрасываются.
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        if frame.f_code is stop:
+            break
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Recording:
+    def __init__(self, delay):
+        self.started = time.perf_counter()
+        self.sample_from = self.started + delay
+        self.samples = Counter()
+        self.finished = False
+
+
+class Sampler(threading.Thread):
+    """Раз в interval секунд снимает стеки потоков, чьи запросы идут
+    дольше своей задержки. Пока запросов нет, поток спит."""
+
+    def __init__(self, interval, stop=None):
+        super().__init__(name='request-sampler', daemon=True)
+        self.interval = interval
+        self.stop = stop
+        self.active = {}
+        self.condition = threading.Condition()
+
+    def track(self, recording):
+        with self.condition:
+            self.active[threading.get_ident()] = recording
+            self.condition.notify()
+
+    def untrack(self):
+        with self.condition:
+            recording = self.active.pop(threading.get_ident())
+            recording.finished = True
+        return recording
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.active:
+                    self.condition.wait()
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            with self.condition:
+                for ident, recording in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and now >= recording.sample_from:
+                        recording.samples[collapse(frame, self.stop)] += 1
+            del frames
+
+
+def sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = Sampler(
+                settings.PROFILING_INTERVAL,
+                stop=ProfilingMiddleware.__call__.__code__,
+            )
+            _sampler.start()
+    return _sampler
+
+
+def write_profile(recording, view, elapsed, queries):
+    """Сохраняет стеки запроса в PROFILING_DIR; в имени файла — view,
+    длительность и число SQL-запросов."""
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    name = '{}-{}-{}-{}ms-{}q.collapsed'.format(
+        time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8],
+        view.replace('/', '_'), round(elapsed * 1000), queries,
+    )
+    path = os.path.join(settings.PROFILING_DIR, name)
+    with open(path, 'w') as output:
+        for stack, count in recording.samples.most_common():
+            output.write(f'{stack} {count}\n')
+    return path
+
+
+class ProfilingMiddleware:
+    """Выборочный профилировщик запросов, включается PROFILING_ENABLED.
+
+    Доля PROFILING_SAMPLE_RATE запросов записывается целиком, остальные
+    — только если идут дольше PROFILING_SLOW_MS, и тогда стеки снимаются
+    с момента, когда порог пройден. Обычный запрос стоит две записи в
+    словарь.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        whole = random.random() < settings.PROFILING_SAMPLE_RATE
+        recording = Recording(
+            0 if whole else settings.PROFILING_SLOW_MS / 1000
+        )
+        active = sampler()
+        active.track(recording)
+        try:
+            response = self.get_response(request)
+        finally:
+            active.untrack()
+        if recording.samples:
+            match = request.resolver_match
+            perf = getattr(request, 'perf', None)
+            write_profile(
+                recording,
+                match.view_name if match else 'unmatched',
+                time.perf_counter() - recording.started,
+                perf.counts['db'] if perf is not None else 0,
+            )
+        return response
@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+# Значения и списки IN разной длины дают одну и ту же форму запроса.
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)')
+SPACE_RE = re.compile(r'\s+')
+
+SHAPE_LENGTH = 200
+
+_local = threading.local()
+
+
+def fingerprint(sql):
+    """Форма запроса: без значений параметров и длины списков IN."""
+    sql = STRING_RE.sub('?', sql.replace('%s', '?'))
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def query_budget(limit):
+    """Наибольшее число SQL-запросов, которое может сделать view.
+
+    Проверяет QueryBudgetMiddleware; бюджет переживает декораторы,
+    сделанные через functools.wraps.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@contextmanager
+def unbudgeted():
+    """Запросы внутри не считаются: для редкой работы, которую обычно
+    делают в фоне, а запрос выполняет лишь как запасной путь."""
+    tracker = getattr(_local, 'tracker', None)
+    if tracker is None:
+        yield
+        return
+    tracker.paused += 1
+    try:
+        yield
+    finally:
+        tracker.paused -= 1
+
+
+def _project_frame(frame, skip):
+    code = frame.f_code
+    # Кадры других execute_wrapper (замеры, лог медленных запросов) —
+    # не место вызова запроса.
+    arguments = code.co_varnames[:code.co_argcount]
+    return (
+        code.co_filename.startswith(settings.BASE_DIR)
+        and 'site-packages' not in code.co_filename
+        and code.co_filename != __file__
+        and code.co_filename not in skip
+        and arguments[-5:] != ('execute', 'sql', 'params', 'many', 'context')
+    )
+
+
+def origin(skip=()):
+    """Откуда выполнен запрос: строка шаблона и ближайший код проекта.
+
+    Кадры из файлов skip пропускаются.
+    """
+    frame = sys._getframe(1)
+    template = code = None
+    while frame is not None and (template is None or code is None):
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            if isinstance(node, Node) and node.token is not None:
+                name = node.origin.template_name or node.origin.name
+                template = f'{name}:{node.token.lineno}'
+        elif code is None and _project_frame(frame, skip):
+            filename = os.path.relpath(
+                frame.f_code.co_filename, settings.BASE_DIR
+            )
+            code = f'{filename}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    return ', '.join(place for place in (template, code) if place)
+
+
+class QueryTracker:
+    """Считает запросы и одинаковые формы SELECT.
+
+    Стек разбирается только у запросов, ставших нарушением: первого
+    сверх бюджета и повтора формы, на котором её сочли N+1, — чтобы
+    обычный запрос стоил один подсчёт.
+    """
+
+    def __init__(self, budget=None, repeats=None):
+        self.budget = budget
+        self.repeats = repeats or settings.QUERY_BUDGET_REPEATS
+        self.count = 0
+        self.paused = 0
+        self.shapes = Counter()
+        self.over_budget = None
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.paused:
+            return execute(sql, params, many, context)
+        self.count += 1
+        if self.budget is not None and self.count == self.budget + 1:
+            self.over_budget = origin()
+        if not many and sql.lstrip()[:6].upper() == 'SELECT':
+            shape = fingerprint(sql)
+            self.shapes[shape] += 1
+            if self.shapes[shape] == self.repeats:
+                self.origins[shape] = origin()
+        return execute(sql, params, many, context)
+
+    def problems(self):
+        found = []
+        if self.over_budget is not None:
+            found.append(
+                f'{self.count} запросов при бюджете {self.budget}, '
+                f'первый лишний: {self.over_budget}'
+            )
+        for shape, place in self.origins.items():
+            found.append(
+                f'N+1: {self.shapes[shape]} × {shape[:SHAPE_LENGTH]} '
+                f'— {place}'
+            )
+        return found
+
+
+class QueryBudgetMiddleware:
+    """Проверяет бюджет запросов view и ищет N+1.
+
+    При QUERY_BUDGET_STRICT нарушение — исключение (разработка и тесты),
+    иначе — предупреждение в лог.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tracker = _local.tracker = request._query_tracker = QueryTracker()
+        try:
+            with connection.execute_wrapper(tracker):
+                response = self.get_response(request)
+        finally:
+            _local.tracker = None
+        problems = tracker.problems()
+        if problems:
+            message = '{} {}:\n{}'.format(
+                request.method, request.path, '\n'.join(problems)
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_tracker.budget = getattr(
+            view_func, 'query_budget', None
+        )
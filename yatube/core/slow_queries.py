@@ -0,0 +1,259 @@
+import atexit
+import glob
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .query_budget import fingerprint, origin
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+PARAMS_LENGTH = 500
+
+SAVEPOINT = 'slow_query_explain'
+
+# Сколько последних выполнений помнить на форму и сколько форм всего.
+OCCURRENCES = 200
+SHAPES = 200
+
+_local = threading.local()
+
+
+def format_plan(rows):
+    """План как текст; у SQLite строки (id, parent, _, detail) — дерево."""
+    lines = []
+    depth = {0: 0}
+    for row in rows:
+        if len(row) == 4:
+            node, parent, _, detail = row
+            depth[node] = depth.get(parent, 0) + 1
+            lines.append('  ' * (depth[node] - 1) + str(detail))
+        else:
+            lines.append(' '.join(str(column) for column in row))
+    return '\n'.join(lines)
+
+
+def explain(connection, sql, params):
+    """План запроса тем же соединением, в обход execute_wrapper:
+    EXPLAIN не должен сам попасть ни в лог, ни в счётчики запроса.
+
+    Внутри транзакции EXPLAIN идёт в точке сохранения: в PostgreSQL его
+    ошибка иначе прервала бы транзакцию вызывающего кода.
+    """
+    if not EXPLAINABLE_RE.match(sql):
+        return ''
+    savepoint = (
+        connection.in_atomic_block and connection.features.uses_savepoints
+    )
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if savepoint:
+            raw.execute(connection.ops.savepoint_create_sql(SAVEPOINT))
+        try:
+            with connection.wrap_database_errors:
+                raw.execute(
+                    f'{connection.ops.explain_query_prefix()} {sql}', params
+                )
+                rows = raw.fetchall()
+        except DatabaseError as error:
+            if savepoint:
+                raw.execute(
+                    connection.ops.savepoint_rollback_sql(SAVEPOINT)
+                )
+            return f'EXPLAIN не удался: {error}'
+        if savepoint:
+            raw.execute(connection.ops.savepoint_commit_sql(SAVEPOINT))
+    return format_plan(rows)
+
+
+def _shape(value):
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def describe_params(sql, params, many):
+    """Параметры для лога. У запросов к таблицам из
+    SLOW_QUERY_REDACTED_TABLES — только типы и длины значений."""
+    tables = '|'.join(map(re.escape, settings.SLOW_QUERY_REDACTED_TABLES))
+    if not tables or not re.search(rf'\b({tables})\b', sql):
+        return repr(params)[:PARAMS_LENGTH]
+    if many:
+        return '<скрыто>'
+    if isinstance(params, dict):
+        return repr({key: _shape(value) for key, value in params.items()})
+    return '(' + ', '.join(_shape(value) for value in params or ()) + ')'
+
+
+class Summary:
+    """Скользящая сводка медленных запросов процесса по формам.
+
+    На каждую форму хранятся последние OCCURRENCES выполнений и пример
+    самого долгого; сводка учитывает только попавшие в окно
+    SLOW_QUERY_WINDOW секунд. Процесс пишет свою сводку в файл
+    SLOW_QUERY_DIR не чаще раза в SLOW_QUERY_FLUSH_INTERVAL секунд,
+    страница складывает файлы всех процессов.
+    """
+
+    def __init__(self):
+        self.shapes = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._flushed_at = 0
+        self.dirty = False
+
+    def _process(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.filename = f'{self._pid}-{time.time_ns()}.pickle'
+            self.shapes = {}
+
+    def add(self, entry):
+        with self._lock:
+            self._process()
+            shape = self.shapes.get(entry['fingerprint'])
+            if shape is None:
+                if len(self.shapes) >= SHAPES:
+                    oldest = min(
+                        self.shapes,
+                        key=lambda key: self.shapes[key]['seen'][-1][0],
+                    )
+                    del self.shapes[oldest]
+                shape = self.shapes[entry['fingerprint']] = {
+                    'seen': deque(maxlen=OCCURRENCES),
+                    'worst': entry,
+                }
+            shape['seen'].append((entry['time'], entry['duration']))
+            if entry['duration'] >= shape['worst']['duration']:
+                shape['worst'] = entry
+            self.dirty = True
+        self.flush()
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._flushed_at < (
+            settings.SLOW_QUERY_FLUSH_INTERVAL
+        ):
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self.dirty:
+                return
+            self._flushed_at = now
+            self.dirty = False
+            data = pickle.dumps(self.shapes, pickle.HIGHEST_PROTOCOL)
+        directory = settings.SLOW_QUERY_DIR
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(data)
+        os.replace(temporary, os.path.join(directory, self.filename))
+
+
+summary = Summary()
+
+
+@atexit.register
+def _flush_on_exit():
+    summary.flush(force=True)
+
+
+def worst_shapes(limit=20):
+    """Формы медленных запросов всех процессов за окно, по суммарному
+    времени."""
+    summary.flush(force=True)
+    since = time.time() - settings.SLOW_QUERY_WINDOW
+    merged = {}
+    paths = glob.glob(os.path.join(settings.SLOW_QUERY_DIR, '*.pickle'))
+    for path in paths:
+        try:
+            if os.path.getmtime(path) < since:
+                # Всё в файле старше окна: процесс завершился или давно
+                # не видел медленных запросов.
+                os.remove(path)
+                continue
+            with open(path, 'rb') as source:
+                shapes = pickle.load(source)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+        for key, shape in shapes.items():
+            durations = [
+                duration for moment, duration in shape['seen']
+                if moment >= since
+            ]
+            if not durations:
+                continue
+            row = merged.setdefault(key, {
+                'fingerprint': key, 'count': 0, 'total': 0.0, 'max': 0.0,
+                'worst': shape['worst'],
+            })
+            row['count'] += len(durations)
+            row['total'] += sum(durations)
+            if max(durations) > row['max']:
+                row['max'] = max(durations)
+                row['worst'] = shape['worst']
+    return sorted(
+        merged.values(), key=lambda row: row['total'], reverse=True
+    )[:limit]
+
+
+class SlowQueryLogger:
+    """execute_wrapper, который пишет в лог запросы дольше SLOW_QUERY_MS
+    с формой, параметрами, местом вызова и планом."""
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_local, 'busy', False):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        threshold = settings.SLOW_QUERY_MS
+        if threshold is not None and duration * 1000 >= threshold:
+            _local.busy = True
+            try:
+                self.record(context['connection'], sql, params, many,
+                            duration)
+            finally:
+                _local.busy = False
+        return result
+
+    def record(self, connection, sql, params, many, duration):
+        entry = {
+            'fingerprint': fingerprint(sql),
+            'sql': sql,
+            'params': describe_params(sql, params, many),
+            'origin': origin(skip=(__file__,)),
+            'plan': '' if many else explain(connection, sql, params),
+            'duration': duration,
+            'time': time.time(),
+        }
+        logger.warning(
+            '%.0f мс: %s\nпараметры: %s\nоткуда: %s\nплан:\n%s',
+            duration * 1000, entry['fingerprint'], entry['params'],
+            entry['origin'] or '-', entry['plan'] or '-',
+            extra={'slow_query': entry},
+        )
+        summary.add(entry)
+
+
+slow_query_logger = SlowQueryLogger()
+
+
+def install(sender, connection, **kwargs):
+    """Обработчик connection_created: логгер ставится один раз на
+    соединение и видит все запросы, а не только запросы из view.
+
+    Встаёт в начало списка: execute_wrapper() снимает обёртки с конца,
+    а соединение может открыться внутри чужого execute_wrapper.
+    """
+    if slow_query_logger not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, slow_query_logger)
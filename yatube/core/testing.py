@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import metrics, slow_queries
+
+
+def isolated_caches(caches):
+    """Те же кэши, но с L2 в памяти процесса вместо общего каталога."""
+    caches = {alias: dict(config) for alias, config in caches.items()}
+    for config in caches.values():
+        options = config.get('OPTIONS', {})
+        if 'L2' in options:
+            config['OPTIONS'] = dict(options, L2={
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'tests',
+            })
+    return caches
+
+
+@contextmanager
+def isolated_environment():
+    """Кэш и каталоги, которые не разделяются с запущенным рядом
+    сервером и не переживают прогон тестов."""
+    directory = tempfile.mkdtemp(prefix='yatube-tests-')
+    try:
+        with override_settings(
+            CACHES=isolated_caches(settings.CACHES),
+            METRICS_DIR=os.path.join(directory, 'metrics'),
+            PROFILING_DIR=os.path.join(directory, 'profiles'),
+            SLOW_QUERY_DIR=os.path.join(directory, 'slow_queries'),
+        ):
+            try:
+                yield directory
+            finally:
+                # Иначе остаток допишет в общий каталог atexit.
+                metrics.registry.flush(force=True)
+                slow_queries.summary.flush(force=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.isolation = ExitStack()
+        self.isolation.enter_context(isolated_environment())
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolation.close()
+        super().teardown_test_environment(**kwargs)
+
+
+class IsolatedTestCase(TestCase):
+    """Пустой кэш и свой временный каталог на каждый тест.
+
+    Настройки из directory_settings указывают в этот каталог.
+    """
+
+    directory_settings = ()
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.override(
+            **dict.fromkeys(self.directory_settings, self.directory)
+        )
+
+    def override(self, **settings):
+        """Настройки до конца теста."""
+        patcher = override_settings(**settings)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
@@ -1,4 +1,35 @@
-from django.test import TestCase
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from io import StringIO
+from itertools import count
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import Context, Template, engines
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings
+
+from posts import views
+from posts.models import Group
+
+from . import instrumentation
+from .cache import TieredCache
+from .instrumentation import Collector
+from .metrics import Registry
+from .profiling import Recording, Sampler
+from .slow_queries import (Summary, explain, slow_query_logger,
+                           worst_shapes)
+from .query_budget import QueryBudgetExceeded, QueryTracker, fingerprint
+from .testing import IsolatedTestCase
+
+User = get_user_model()
 
 
 class ViewTestClass(TestCase):
@@ -6,3 +37,353 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        params = {
+            'OPTIONS': {
+                'SYNC_INTERVAL': 0,
+                'L2': {
+                    'BACKEND': 'core.cache.FileBasedCache',
+                    'LOCATION': location,
+                },
+            },
+        }
+        # Два экземпляра с общим L2 изображают два рабочих процесса.
+        self.first = TieredCache('', params)
+        self.second = TieredCache('', params)
+
+    def test_hits_are_counted_per_tier(self):
+        """L1 отвечает повторно, L2 — при первом чтении"""
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertIsNone(self.second.get('missing'))
+        stats = self.second.get_stats()
+        self.assertEqual(stats['l1_hits'], 1)
+        self.assertEqual(stats['l2_hits'], 1)
+        self.assertEqual(stats['l2_misses'], 1)
+
+    def test_write_in_other_process_invalidates_l1(self):
+        """Запись в одном процессе видна в другом"""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_write_keeps_other_namespaces_in_l1(self):
+        """Запись сбрасывает в чужом L1 только своё пространство ключей"""
+        self.first.set('page:index', 'old')
+        self.first.set('feed:ids', 'ids')
+        for key in ('page:index', 'feed:ids'):
+            self.second.get(key)
+        self.first.set('page:index', 'new')
+        self.assertEqual(self.second.get('page:index'), 'new')
+        hits = self.second.get_stats()['l1_hits']
+        self.assertEqual(self.second.get('feed:ids'), 'ids')
+        self.assertEqual(self.second.get_stats()['l1_hits'], hits + 1)
+
+    def test_concurrent_incr_not_lost(self):
+        """incr файлового L2 атомарен"""
+        self.first.l2.set('counter', 0)
+
+        def increment():
+            for _ in range(50):
+                self.second.l2.incr('counter')
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.first.l2.get('counter'), 200)
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for number in range(5):
+            User.objects.create_user(username=f'user{number}')
+
+    def test_fingerprint_ignores_values(self):
+        """Значения и длина списка IN не меняют форму запроса"""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND x = 'a'"),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)  AND x = 7'),
+        )
+
+    def test_repeated_shape_reported_with_call_site(self):
+        """Повтор одной формы SELECT — N+1 с местом вызова"""
+        tracker = QueryTracker(repeats=3)
+        with connection.execute_wrapper(tracker):
+            for user in User.objects.all():
+                User.objects.get(pk=user.pk)
+        problems = tracker.problems()
+        self.assertEqual(len(problems), 1)
+        self.assertIn('N+1: 5 ×', problems[0])
+        self.assertIn('core/tests.py', problems[0])
+
+    def test_repeated_shape_reported_with_template_line(self):
+        """N+1 из шаблона указывает на его строку"""
+        template = Template(
+            '{% for user in users %}\n{{ user.stats.posts_count }}'
+            '{% endfor %}'
+        )
+        tracker = QueryTracker(repeats=3)
+        with connection.execute_wrapper(tracker):
+            template.render(Context({'users': User.objects.all()}))
+        self.assertIn(':2', tracker.problems()[0])
+
+    def test_exceeded_budget_raises_in_strict_mode(self):
+        """Превышение бюджета view — исключение"""
+        with mock.patch.object(views.index, 'query_budget', 0):
+            with self.assertRaisesMessage(
+                QueryBudgetExceeded, 'при бюджете 0'
+            ):
+                self.client.get('/')
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_exceeded_budget_logged_otherwise(self):
+        """Без строгого режима превышение пишется в лог"""
+        with mock.patch.object(views.index, 'query_budget', 0):
+            with self.assertLogs('core.query_budget', 'WARNING'):
+                response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+
+
+class ServerTimingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author')
+
+    def test_header_reports_sql_templates_and_page_cache(self):
+        """Server-Timing показывает SQL, шаблоны и исход кэша страницы"""
+        timing = self.client.get('/')['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('page;desc="index_page:recompute"', timing)
+        timing = self.client.get('/')['Server-Timing']
+        self.assertIn('page;desc="index_page:hit"', timing)
+        self.assertIn('cache;desc=', timing)
+
+    def test_nested_render_counted_once(self):
+        """Вложенная отрисовка не удваивает время шаблонов"""
+        outer = engines.all()[0].from_string('{{ inner }}')
+        collector = Collector()
+        token = instrumentation._current.set(collector)
+        self.addCleanup(instrumentation._current.reset, token)
+        # Каждый вызов часов — следующая секунда.
+        clock = mock.Mock(perf_counter=mock.Mock(side_effect=count()))
+        with mock.patch.object(instrumentation, 'time', clock):
+            outer.render({'inner': lambda: render_to_string(
+                'posts/includes/paginator.html'
+            )})
+        self.assertEqual(clock.perf_counter.call_count, 2)
+        self.assertEqual(collector.timings['tpl'], 1)
+
+    @override_settings(REQUEST_LOG=True)
+    def test_request_logged(self):
+        """Строка лога содержит view и число запросов"""
+        with self.assertLogs('core.instrumentation', 'INFO') as logs:
+            self.client.get(f'/profile/{self.user.username}/')
+        self.assertIn('view=post:profile', logs.output[0])
+        self.assertRegex(logs.output[0], r'db_queries=\d+')
+
+    def test_collector_fields(self):
+        collector = Collector()
+        collector.counts['cache_hits'] += 2
+        collector.marks['page'] = 'index_page:hit'
+        collector.finish()
+        fields = collector.fields()
+        self.assertEqual(fields['cache_hits'], 2)
+        self.assertEqual(fields['db_queries'], 0)
+        self.assertEqual(fields['page'], 'index_page:hit')
+
+
+class MetricsTest(IsolatedTestCase):
+    directory_settings = ('METRICS_DIR',)
+
+    def registry(self):
+        registry = Registry()
+        registry.counter('hits_total', 'Попадания', ('page',))
+        registry.histogram('latency_seconds', 'Время', buckets=(0.1, 1))
+        return registry
+
+    def test_processes_are_summed(self):
+        """Значения разных процессов складываются"""
+        first, second = self.registry(), self.registry()
+        first.metrics['hits_total'].inc(page='index')
+        second.metrics['hits_total'].inc(2, page='index')
+        second.flush(force=True)
+        self.assertIn('hits_total{page="index"} 3', first.exposition())
+
+    def test_dead_processes_compacted(self):
+        """Файлы завершившихся процессов сливаются в один и не
+        складываются дважды"""
+        process = subprocess.Popen(['true'])
+        process.wait()
+        dead, alive = self.registry(), self.registry()
+        dead.metrics['hits_total'].inc(5, page='index')
+        dead.filename = f'{process.pid}-1.pickle'
+        dead.flush(force=True)
+        for _ in range(2):
+            self.assertIn(
+                'hits_total{page="index"} 5', alive.exposition()
+            )
+        self.assertNotIn(dead.filename, os.listdir(self.directory))
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = self.registry()
+        for value in (0.05, 0.1, 0.5, 3):
+            registry.metrics['latency_seconds'].observe(value)
+        text = registry.exposition()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_sum 3.65', text)
+        self.assertIn('latency_seconds_count 4', text)
+
+    def test_endpoint_for_staff_only(self):
+        """/metrics/ отдаёт запросы по view только персоналу"""
+        self.client.get('/')
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 302)
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(
+            response,
+            'yatube_http_requests_total'
+            '{view="post:main_page",method="GET",status="200"}',
+        )
+
+
+class ProfilingTest(IsolatedTestCase):
+    directory_settings = ('PROFILING_DIR',)
+
+    def test_sampler_records_stacks_after_delay(self):
+        """Стеки снимаются только после задержки записи"""
+        sampler = Sampler(0.001)
+        sampler.start()
+        recordings = []
+
+        def request(delay):
+            recording = Recording(delay)
+            sampler.track(recording)
+            time.sleep(0.05)
+            recordings.append(sampler.untrack())
+
+        for delay in (0, 10):
+            thread = threading.Thread(target=request, args=[delay])
+            thread.start()
+            thread.join()
+        sampled, skipped = recordings
+        self.assertFalse(skipped.samples)
+        stack = sampled.samples.most_common(1)[0][0]
+        self.assertTrue(stack.endswith('core/tests.py:request'))
+
+    def test_slow_request_profiled_and_merged(self):
+        """Медленный запрос оставляет профиль, merge_profiles его
+        складывает"""
+        paginate = views.paginator_func
+
+        def slow_paginate(*args):
+            # Запрос длиннее интервала снимков на любой машине.
+            time.sleep(0.05)
+            return paginate(*args)
+
+        with override_settings(
+            PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0,
+            PROFILING_SLOW_MS=0,
+        ), mock.patch.object(views, 'paginator_func', slow_paginate):
+            self.client.get('/')
+        [name] = os.listdir(self.directory)
+        self.assertRegex(name, r'-post:main_page-\d+ms-\d+q\.collapsed$')
+        output = os.path.join(self.directory, 'merged.folded')
+        stdout = StringIO()
+        call_command(
+            'merge_profiles', dir=self.directory, output=output,
+            stdout=stdout,
+        )
+        self.assertIn('post:main_page', stdout.getvalue())
+        with open(output) as merged:
+            first = merged.readline()
+        self.assertTrue(first.startswith('core/profiling.py:__call__;'))
+
+
+class SlowQueryTest(IsolatedTestCase):
+    directory_settings = ('SLOW_QUERY_DIR',)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='author')
+        super().setUp()
+        # Медленным считается любой запрос.
+        self.override(SLOW_QUERY_MS=0)
+        patcher = mock.patch('core.slow_queries.summary', Summary())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_installed_once_on_connection(self):
+        self.assertEqual(
+            connection.execute_wrappers.count(slow_query_logger), 1
+        )
+
+    def test_slow_query_logged_with_plan_and_origin(self):
+        """В логе форма, параметры, место вызова и план, но не EXPLAIN"""
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            User.objects.filter(username='author').first()
+        self.assertEqual(len(logs.records), 1)
+        entry = logs.records[0].slow_query
+        self.assertIn('"username" = ?', entry['fingerprint'])
+        self.assertIn('core/tests.py', entry['origin'])
+        self.assertIn('auth_user', entry['plan'])
+
+    def test_params_of_sensitive_tables_redacted(self):
+        """Значения параметров скрыты только у чувствительных таблиц"""
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            User.objects.filter(username='author').first()
+            Group.objects.filter(slug='secret-free').first()
+        users, groups = [record.slow_query for record in logs.records]
+        self.assertNotIn('author', users['params'])
+        self.assertIn('str[6]', users['params'])
+        self.assertIn("'secret-free'", groups['params'])
+
+    def test_failed_explain_keeps_transaction(self):
+        """Ошибка EXPLAIN не ломает транзакцию вызывающего кода"""
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            with transaction.atomic():
+                plan = explain(
+                    connection, 'SELECT * FROM missing_table', ()
+                )
+                self.assertIn('EXPLAIN не удался', plan)
+                self.assertTrue(
+                    User.objects.filter(username='author').exists()
+                )
+
+    def test_summary_groups_by_shape(self):
+        """Сводка складывает выполнения одной формы"""
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            for username in ('author', 'nobody'):
+                User.objects.filter(username=username).exists()
+        [row] = [
+            row for row in worst_shapes()
+            if row['fingerprint'].startswith('SELECT (?) AS "a"')
+        ]
+        self.assertEqual(row['count'], 2)
+
+    def test_summary_page_for_staff_only(self):
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            response = self.client.get('/slow-queries/')
+            self.assertEqual(response.status_code, 302)
+            self.user.is_staff = True
+            self.user.save()
+            self.client.force_login(self.user)
+            response = self.client.get('/slow-queries/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'откуда:')
@@ -1,5 +1,9 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from . import metrics, slow_queries
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -15,3 +19,33 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(
+        metrics.registry.exposition(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@staff_member_required
+def slow_queries_view(request):
+    """Худшие формы медленных запросов за окно, по суммарному времени."""
+    lines = []
+    for row in slow_queries.worst_shapes():
+        worst = row['worst']
+        lines += [
+            '{:.0f} мс всего, {} раз, худший {:.0f} мс'.format(
+                row['total'] * 1000, row['count'], row['max'] * 1000
+            ),
+            row['fingerprint'],
+            f'параметры: {worst["params"]}',
+            f'откуда: {worst["origin"] or "-"}',
+            worst['plan'] or '-',
+            '',
+        ]
+    return HttpResponse(
+        '\n'.join(lines) or 'Медленных запросов нет\n',
+        content_type='text/plain; charset=utf-8',
+    )
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
+from . import search
 from .models import Group, Post, Comment
+from .paginators import EstimatedCountPaginator
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -11,11 +13,24 @@ class PostAdmin(admin.ModelAdmin):
         'author',
         'group'
     )
-    list_editable = ('group', 'text',)
+    # Группа правится на странице поста: в списке её <select> на каждой
+    # строке либо тянет все группы, либо делает по запросу на строку.
+    list_editable = ('text',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # icontains по тексту — полный проход по таблице, индекс быстрее.
+        if search_term and search.available():
+            return search.filter_posts(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -23,13 +38,17 @@ class GroupAdmin(admin.ModelAdmin):
         'description'
     )
     search_fields = ('title',)
-    list_filter = ('title',)
 
 
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('text', 'author', 'post', 'created')
-    search_fields = ('text', 'author',)
-    list_filter = ('created', 'post')
+    list_select_related = ('author', 'post')
+    autocomplete_fields = ('author', 'post')
+    search_fields = ('text', 'author__username',)
+    list_filter = ('created',)
+    date_hierarchy = 'created'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,50 @@
+from django.db import connection, transaction
+from django.db.models import F
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .models import ImageBlob
+from .storage import content_storage
+
+
+def retain(name):
+    """Ещё одна ссылка на файл.
+
+    Одним INSERT ... ON CONFLICT: между созданием строки и увеличением
+    счётчика collect() не успеет удалить её вместе с файлом.
+    """
+    if not name:
+        return
+    table = connection.ops.quote_name(ImageBlob._meta.db_table)
+    references = connection.ops.quote_name('references')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (name, {references}) VALUES (%s, 1) '
+            f'ON CONFLICT (name) DO UPDATE '
+            f'SET {references} = {table}.{references} + 1',
+            [name],
+        )
+
+
+def release(name):
+    """Минус одна ссылка; файл без ссылок удаляется после фиксации."""
+    if not name:
+        return
+    ImageBlob.objects.filter(name=name, references__gt=0).update(
+        references=F('references') - 1
+    )
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    # Пока шла транзакция, тот же файл мог загрузить кто-то ещё: строка
+    # перепроверяется под блокировкой и держится до удаления файла.
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(
+            name=name, references=0
+        ).first()
+        if blob is None:
+            return
+        blob.delete()
+        default.kvstore.delete(ImageFile(name, content_storage))
+        content_storage.delete(name)
@@ -0,0 +1,114 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import thumbnails
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+
+
+def version_key(scope, pk):
+    return f'version:{scope}:{pk}'
+
+
+def new_version():
+    return str(time.time_ns())
+
+
+def _bump_keys(keys):
+    # Версия меняется сразу и ещё раз после коммита: запрос, который до
+    # коммита прочитал старую строку, сохранит фрагмент под версией,
+    # которой после коммита уже не будет.
+    def bump_now():
+        cache.set_many({key: new_version() for key in keys}, None)
+
+    bump_now()
+    transaction.on_commit(bump_now)
+
+
+def bump(scope, pk):
+    """Делает недействительными все фрагменты, зависящие от объекта."""
+    _bump_keys([version_key(scope, pk)])
+
+
+def page_key(scope):
+    return f'version:page:{scope}'
+
+
+def bump_pages(*scopes):
+    """Меняет версии страниц: 'index', 'group:<id>', 'profile:<id>',
+    'post:<id>' или 'all' для всех сразу."""
+    _bump_keys([page_key(scope) for scope in scopes])
+
+
+def page_versions(scopes):
+    versions = get_versions(page_key(scope) for scope in scopes)
+    return [versions[page_key(scope)] for scope in scopes]
+
+
+def get_versions(keys):
+    """Версии по ключам одним запросом; потерянные версии создаются
+    заново, так что после вытеснения кэша старые фрагменты не всплывут.
+    """
+    keys = set(keys)
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys - versions.keys()}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def _card_keys(posts, variant):
+    version_keys = {}
+    for post in posts:
+        version_keys[post.pk] = (
+            version_key('post', post.pk),
+            version_key('group', post.group_id),
+            version_key('author', post.author_id),
+        )
+    versions = get_versions(
+        key for keys in version_keys.values() for key in keys
+    )
+    return {
+        post.pk: 'post_card:{}:{}:{}'.format(
+            post.pk,
+            ':'.join(versions[key] for key in version_keys[post.pk]),
+            variant,
+        )
+        for post in posts
+    }
+
+
+def render_cards(posts, author=None, group=None):
+    """Отрисованные карточки постов страницы, по возможности из кэша.
+
+    Карточка зависит от версии поста, его группы и автора, а также от
+    того, показывает ли страница автора и группу сама.
+    """
+    # У страницы берём object_list: итерация по самой Page превратила
+    # бы QuerySet в список.
+    posts = list(getattr(posts, 'object_list', posts))
+    if not posts:
+        return []
+    variant = f'{int(author is None)}{int(group is None)}'
+    keys = _card_keys(posts, variant)
+    cards = cache.get_many(keys.values())
+    missed = [post for post in posts if keys[post.pk] not in cards]
+    thumbnails.attach(missed)
+    rendered = {
+        keys[post.pk]: render_to_string(CARD_TEMPLATE, {
+            'post': post,
+            'author': author,
+            'group': group,
+        })
+        for post in missed
+    }
+    if rendered:
+        cache.set_many(rendered, settings.POST_CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+    return [mark_safe(cards[keys[post.pk]]) for post in posts]
@@ -0,0 +1,19 @@
+from django.conf import settings
+
+from .models import Comment
+from .paginators import CursorPaginator
+from .utils import cursor_page
+
+
+def comment_page(request, post_id):
+    """Страница комментариев поста по курсору, от старых к новым.
+
+    Авторы подгружаются тем же запросом, так что стоимость не зависит
+    от числа комментариев под постом.
+    """
+    comments = Comment.objects.filter(post_id=post_id).select_related(
+        'author'
+    )
+    return cursor_page(request, CursorPaginator(
+        comments, settings.COMMENTS_PAGE_NUMBER, ordering=('created', 'pk')
+    ))
@@ -0,0 +1,105 @@
+import hashlib
+from datetime import datetime
+
+from django.db.models import Max
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .cache import page_versions
+from .models import Comment, Group, Post, User
+
+
+def _validators(request, scopes, watermarks):
+    versions = page_versions(('all',) + tuple(scopes))
+    user_parts = ()
+    if request.user.is_authenticated:
+        # Шапка и кнопка подписки зависят от читателя, а CSRF-токен формы
+        # меняется при каждом входе вместе с ключом сессии.
+        user_parts = (request.user.pk, request.session.session_key)
+    parts = (
+        request.get_full_path(), *user_parts, *versions, *watermarks
+    )
+    etag = hashlib.md5(
+        '|'.join(map(str, parts)).encode()
+    ).hexdigest()
+    last_modified = max(
+        [watermark for watermark in watermarks
+         if isinstance(watermark, datetime)]
+        + [datetime.fromtimestamp(int(version) / 1e9, timezone.utc)
+           for version in versions]
+    )
+    return etag, last_modified
+
+
+def get_validators(request, scope_func, *args, **kwargs):
+    """(ETag, Last-Modified) страницы, посчитанные один раз на запрос.
+
+    scope_func(request, **kwargs) возвращает области версий страницы
+    и водяные знаки из индексных запросов либо None, если объекта нет.
+    """
+    if not hasattr(request, '_page_validators'):
+        scope = scope_func(request, *args, **kwargs)
+        request._page_validators = (
+            None if scope is None else _validators(request, *scope)
+        )
+    return request._page_validators
+
+
+def page_condition(scope_func):
+    """Условный GET для страницы: ETag и Last-Modified без рендеринга."""
+    def etag(request, *args, **kwargs):
+        validators = get_validators(request, scope_func, *args, **kwargs)
+        return validators and validators[0]
+
+    def last_modified(request, *args, **kwargs):
+        validators = get_validators(request, scope_func, *args, **kwargs)
+        if validators is None or request.user.is_authenticated:
+            # Last-Modified не различает читателей, поэтому только гостям.
+            return None
+        return validators[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _latest(queryset):
+    return queryset.aggregate(latest=Max('pub_date'))['latest']
+
+
+def index_scope(request):
+    return ('index',), (_latest(Post.objects.all()),)
+
+
+def group_scope(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return (
+        (f'group:{group_id}',),
+        (_latest(Post.objects.filter(group_id=group_id)),),
+    )
+
+
+def profile_scope(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return (
+        (f'profile:{author_id}',),
+        (_latest(Post.objects.filter(author_id=author_id)),),
+    )
+
+
+def post_scope(request, post_id):
+    author_id = Post.objects.filter(pk=post_id).values_list(
+        'author_id', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    last_comment = Comment.objects.filter(post_id=post_id).aggregate(
+        last=Max('created')
+    )['last']
+    return (f'post:{post_id}', f'profile:{author_id}'), (last_comment,)
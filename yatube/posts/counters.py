@@ -0,0 +1,126 @@
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Comment, Follow, Post, User, UserStats
+
+CHUNK_SIZE = 1000
+
+
+def _change(queryset, field, delta):
+    if delta < 0:
+        # Не уводим счётчик в минус, если он уже разошёлся с данными.
+        queryset = queryset.filter(**{f'{field}__gt': 0})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def recount_user(user_id):
+    stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'posts_count': Post.objects.filter(author_id=user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id
+            ).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id
+            ).count(),
+        },
+    )
+    return stats
+
+
+def change_user(user_id, field, delta):
+    """Меняет счётчик пользователя и возвращает его новое значение.
+
+    Уменьшение счётчика без строки ничего не делает и возвращает None.
+    """
+    with transaction.atomic():
+        stats = UserStats.objects.filter(user_id=user_id)
+        if not stats.exists():
+            if delta < 0:
+                # Строка удалена каскадом вместе с пользователем, которого
+                # сейчас удаляют, — создавать её нельзя. Если же счётчики
+                # просто разошлись, их исправит reconcile_counters.
+                return None
+            # Строки ещё нет: считаем сразу по данным, изменение уже в них.
+            return getattr(recount_user(user_id), field)
+        _change(stats, field, delta)
+        return stats.values_list(field, flat=True).get()
+
+
+def change_post_comments(post_id, delta):
+    _change(Post.objects.filter(pk=post_id), 'comments_count', delta)
+
+
+def _counts(queryset, field, ids):
+    return dict(
+        queryset.filter(**{f'{field}__in': ids}).values_list(field).annotate(
+            total=Count('pk')
+        ).order_by()
+    )
+
+
+def _chunks(queryset):
+    last_pk = 0
+    while True:
+        ids = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', flat=True
+            )[:CHUNK_SIZE]
+        )
+        if not ids:
+            return
+        yield ids
+        last_pk = ids[-1]
+
+
+@transaction.atomic
+def reconcile():
+    """Пересчитывает все счётчики и чинит разошедшиеся.
+
+    Возвращает число исправленных строк.
+    """
+    fixed = 0
+    for ids in _chunks(User.objects.all()):
+        posts = _counts(Post.objects, 'author_id', ids)
+        followers = _counts(Follow.objects, 'author_id', ids)
+        following = _counts(Follow.objects, 'user_id', ids)
+        existing = UserStats.objects.in_bulk(ids)
+        created, changed = [], []
+        for user_id in ids:
+            actual = UserStats(
+                user_id=user_id,
+                posts_count=posts.get(user_id, 0),
+                followers_count=followers.get(user_id, 0),
+                following_count=following.get(user_id, 0),
+            )
+            stats = existing.get(user_id)
+            if stats is None:
+                created.append(actual)
+            elif (
+                stats.posts_count, stats.followers_count,
+                stats.following_count,
+            ) != (
+                actual.posts_count, actual.followers_count,
+                actual.following_count,
+            ):
+                changed.append(actual)
+        UserStats.objects.bulk_create(created)
+        UserStats.objects.bulk_update(
+            changed,
+            ('posts_count', 'followers_count', 'following_count'),
+        )
+        fixed += len(created) + len(changed)
+    for ids in _chunks(Post.objects.all()):
+        comments = _counts(Comment.objects, 'post_id', ids)
+        changed = [
+            post for post in Post.objects.filter(pk__in=ids).only(
+                'comments_count'
+            )
+            if post.comments_count != comments.get(post.pk, 0)
+        ]
+        for post in changed:
+            post.comments_count = comments.get(post.pk, 0)
+        Post.objects.bulk_update(changed, ('comments_count',))
+        fixed += len(changed)
+    return fixed
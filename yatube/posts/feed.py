@@ -0,0 +1,176 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import CursorPaginator, keyset_filter
+
+CELEBRITIES_CACHE_KEY = 'feed:celebrities'
+
+# Сколько авторов читает один UNION ALL: SQLite не принимает больше 500
+# частей в одном составном запросе.
+UNION_AUTHORS = 100
+
+
+def celebrity_ids():
+    """Авторы, у которых подписчиков больше порога рассылки.
+
+    Их посты не раскладываются по лентам, а подтягиваются при чтении.
+    """
+    ids = cache.get(CELEBRITIES_CACHE_KEY)
+    if ids is None:
+        ids = frozenset(
+            UserStats.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_THRESHOLD
+            ).values_list('user_id', flat=True)
+        )
+        cache.set(
+            CELEBRITIES_CACHE_KEY, ids, settings.FEED_CELEBRITIES_TIMEOUT
+        )
+    return ids
+
+
+def reset_celebrities():
+    cache.delete(CELEBRITIES_CACHE_KEY)
+
+
+def is_celebrity(author_id):
+    return author_id in celebrity_ids()
+
+
+def chunk_query(queryset, fields, values, descending, size, authors=None):
+    """Запрос одной пачки потока: до size строк строго после values.
+
+    Поток по списку авторов читается одним UNION ALL запросов по каждому
+    автору: каждый идёт по индексу (author, -pub_date, -id) с курсора и
+    берёт не больше size строк, так что общая сортировка касается лишь
+    этих строк, а не всех постов авторов. Первые size строк объединения
+    и есть первые size строк потока.
+    """
+    ordering = [f'-{name}' if descending else name for name in fields]
+    chunk = queryset.order_by(*ordering)
+    if values is not None:
+        chunk = chunk.filter(keyset_filter(fields, values, descending))
+    if authors is not None:
+        parts, params = [], []
+        for author_id in authors:
+            sql, part_params = chunk.filter(author_id=author_id).values(
+                'pk'
+            )[:size].query.sql_with_params()
+            parts.append(f'SELECT * FROM ({sql})')
+            params.extend(part_params)
+        # RawSQL в pk__in оборачивается в лишние скобки, и SQLite читает
+        # объединение как скалярный подзапрос.
+        meta = queryset.model._meta
+        column = '{}.{}'.format(
+            connection.ops.quote_name(meta.db_table),
+            connection.ops.quote_name(meta.pk.column),
+        )
+        chunk = queryset.extra(
+            where=[f'{column} IN ({" UNION ALL ".join(parts)})'],
+            params=params,
+        ).order_by(*ordering)
+    return chunk[:size]
+
+
+def _stream(source, values, descending, chunk_size):
+    """Лениво читает отсортированный поток постов пачками по ключу.
+
+    Выдаёт пары (ключ, пост), где ключ — (pub_date, id поста).
+    """
+    queryset, fields, authors = source
+    while True:
+        rows = list(chunk_query(
+            queryset, fields, values, descending, chunk_size, authors
+        ))
+        for row in rows:
+            post = getattr(row, 'post', row)
+            yield (post.pub_date, post.pk), post
+        if len(rows) < chunk_size:
+            return
+        values = [getattr(rows[-1], name) for name in fields]
+
+
+class FeedPaginator(CursorPaginator):
+    """Лента «Избранные авторы»: push для обычных авторов, pull для
+    популярных.
+
+    Посты обычных авторов уже лежат в TimelineEntry читателя, посты
+    популярных авторов читаются по индексу каждого автора, по
+    UNION_AUTHORS авторов в запросе. Потоки сливаются через кучу, и
+    чтение прекращается, как только набрана страница, поэтому стоимость
+    зависит от размера страницы, а не от числа постов авторов.
+
+    sources — потоки ленты: (queryset, поля ключа, авторы или None).
+    """
+
+    def __init__(self, user, per_page, **kwargs):
+        super().__init__(Post.objects.all(), per_page, **kwargs)
+        self.sources = [(
+            TimelineEntry.objects.filter(user=user).select_related(
+                'post__author', 'post__group'
+            ),
+            ('pub_date', 'post_id'),
+            None,
+        )]
+        if celebrity_ids():
+            pulled = list(Follow.objects.filter(
+                user=user, author__stats__followers_count__gt=(
+                    settings.FEED_FANOUT_THRESHOLD
+                ),
+            ).order_by('author_id').values_list('author_id', flat=True))
+            posts = Post.objects.select_related('author', 'group')
+            for start in range(0, len(pulled), UNION_AUTHORS):
+                self.sources.append((
+                    posts, ('pub_date', 'pk'),
+                    pulled[start:start + UNION_AUTHORS],
+                ))
+
+    def chunk_queries(self, values=None, descending=True):
+        """Запросы первой пачки каждого потока — то, что выполняет
+        страница ленты."""
+        return [
+            chunk_query(
+                queryset, fields, values, descending, self.per_page + 1,
+                authors,
+            )
+            for queryset, fields, authors in self.sources
+        ]
+
+    def _merge(self, values, descending):
+        streams = [
+            _stream(source, values, descending, self.per_page + 1)
+            for source in self.sources
+        ]
+        merged = heapq.merge(
+            *streams, key=lambda item: item[0], reverse=descending
+        )
+        seen = set()
+        for key, post in merged:
+            # Пост мог попасть и в ленту, и в поток популярного автора.
+            if post.pk not in seen:
+                seen.add(post.pk)
+                yield post
+
+    def page_after(self, values=None):
+        posts = list(islice(self._merge(values, True), self.per_page + 1))
+        return self._get_page(
+            posts[:self.per_page], None, self,
+            has_next=len(posts) > self.per_page,
+            has_previous=values is not None,
+        )
+
+    def page_before(self, values=None):
+        posts = list(islice(self._merge(values, False), self.per_page + 1))
+        if not posts:
+            return self.page_after()
+        page = posts[:self.per_page]
+        page.reverse()
+        return self._get_page(
+            page, None, self,
+            has_next=values is not None,
+            has_previous=len(posts) > self.per_page,
+        )
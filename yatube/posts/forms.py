@@ -1,5 +1,6 @@
 from django import forms
 
+from .images import normalize, strip_metadata
 from .models import Post, Comment
 
 
@@ -10,6 +11,37 @@ class PostForm(forms.ModelForm):
         labels = {'text': 'Текст сюда', 'group': 'Любую или никакую группу'}
         help_text = {'text': 'Всё что угодно', 'group': 'Из предложеных :)'}
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+
+    def clean(self):
+        # Отброшенный при загрузке файл до формы не доходит, поэтому
+        # без этого поле выглядело бы просто пустым.
+        for field, message in self.upload_errors.items():
+            self.add_error(field, message)
+        return super().clean()
+
+    def save(self, commit=True):
+        post = super().save(commit=False)
+        if 'image' in self.changed_data:
+            # Оригинал хранится без метаданных, показывается пережатая
+            # копия. Старую копию не удаляем: она может быть общей с
+            # другими постами, её освободит счётчик ссылок.
+            post.image_web = None
+            post.image_size = None
+            if post.image:
+                stripped = strip_metadata(self.cleaned_data['image'])
+                if stripped is not None:
+                    post.image = stripped
+                web = normalize(self.cleaned_data['image'])
+                # Файл запишется вместе с постом, как и оригинал.
+                post.image_web = web
+                post.image_size = web.size
+        if commit:
+            post.save()
+        return post
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,108 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+EXTENSIONS = {'AVIF': 'avif', 'WEBP': 'webp', 'JPEG': 'jpg'}
+
+# Ключи Image.info, в которых Pillow отдаёт метаданные файла.
+METADATA = ('exif', 'xmp', 'XML:com.adobe.xmp', 'photoshop', 'comment')
+
+# Форматы, которые пересохраняются в себя же; остальные — в PNG.
+KEPT_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+ORIENTATION = 0x0112
+
+
+def web_format():
+    """Первый из IMAGE_WEB_FORMATS, который умеет сохранять Pillow."""
+    Image.init()
+    for name in settings.IMAGE_WEB_FORMATS:
+        if name in Image.SAVE:
+            return name
+    return 'JPEG'
+
+
+def normalize(upload):
+    """Копия картинки для показа: повернутая по EXIF, уменьшенная до
+    IMAGE_MAX_SIDE по большей стороне и пересжатая без метаданных.
+
+    Возвращает ContentFile с именем вида <исходное имя>.<формат>.
+    """
+    upload.seek(0)
+    with Image.open(upload) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(
+            (settings.IMAGE_MAX_SIDE, settings.IMAGE_MAX_SIDE),
+            Image.LANCZOS,
+        )
+        image_format = web_format()
+        if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in image.mode or 'transparency' in image.info
+            image = image.convert(
+                'RGBA' if has_alpha and image_format != 'JPEG' else 'RGB'
+            )
+        buffer = BytesIO()
+        # Новый файл собирается из пикселей, поэтому EXIF, ICC и прочие
+        # метаданные оригинала в него не попадают.
+        image.save(
+            buffer, image_format,
+            quality=settings.IMAGE_WEB_QUALITY, optimize=True,
+        )
+    upload.seek(0)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    extension = EXTENSIONS[image_format]
+    return ContentFile(buffer.getvalue(), f'{name}.{extension}')
+
+
+def _resave_options(source, transposed):
+    """Формат и параметры save() для оригинала без метаданных."""
+    options = {'exif': b'', 'comment': b''}
+    for key in ('icc_profile', 'transparency'):
+        if key in source.info:
+            options[key] = source.info[key]
+    if getattr(source, 'is_animated', False):
+        options['save_all'] = True
+    if source.format not in KEPT_FORMATS:
+        return 'PNG', options
+    if source.format == 'JPEG':
+        options.update(
+            {'quality': 95} if transposed
+            else {'quality': 'keep', 'subsampling': 'keep'}
+        )
+    elif source.format == 'WEBP':
+        options['lossless'] = True
+    return source.format, options
+
+
+def strip_metadata(upload):
+    """Оригинал без EXIF и прочих метаданных: в них бывают координаты
+    съёмки и серийный номер камеры, а оригинал доступен по ссылке.
+
+    Поворот из EXIF переносится в пиксели, ICC-профиль остаётся. JPEG
+    без поворота пересжимается с таблицами квантования оригинала,
+    WebP — без потерь. Возвращает ContentFile с исходным именем или
+    None, если метаданных нет и файл можно хранить как есть.
+    """
+    upload.seek(0)
+    with Image.open(upload) as source:
+        exif = source.getexif()
+        if not exif and not any(key in source.info for key in METADATA):
+            upload.seek(0)
+            return None
+        image = source
+        if (
+            not getattr(source, 'is_animated', False)
+            and exif.get(ORIENTATION, 1) != 1
+        ):
+            image = ImageOps.exif_transpose(source)
+        image_format, options = _resave_options(source, image is not source)
+        buffer = BytesIO()
+        image.save(buffer, image_format, **options)
+        name = os.path.basename(upload.name)
+        if image_format != source.format:
+            name = f'{os.path.splitext(name)[0]}.png'
+    upload.seek(0)
+    return ContentFile(buffer.getvalue(), name)
@@ -0,0 +1,125 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+WORDS = (
+    'день город вечер друг работа дом утро кофе книга море дорога музыка '
+    'кот собака солнце дождь снег лето зима осень весна парк река лес '
+    'поезд самолёт фильм игра код python django база запрос индекс '
+    'страница лента подписка автор группа картинка комментарий новость'
+).split()
+
+
+def _texts(count, seed):
+    """Тексты постов с частотами слов по закону Ципфа."""
+    rng = random.Random(seed)
+    vocabulary = WORDS + [f'слово{number}' for number in range(20000)]
+    weights = list(accumulate(
+        1 / rank for rank in range(1, len(vocabulary) + 1)
+    ))
+    for _ in range(count):
+        yield ' '.join(rng.choices(
+            vocabulary, cum_weights=weights, k=rng.randint(5, 60)
+        ))
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает поиск по FTS5 с icontains (LIKE) на синтетическом '
+        'корпусе во временной базе SQLite'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument(
+            '--queries', nargs='+',
+            default=['кофе', 'django индекс', 'слово19999', 'самол'],
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def _time(self, cursor, sql, params, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = cursor.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - started)
+        return best * 1000, len(rows)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'bench.sqlite3')
+        connection = sqlite3.connect(path)
+        cursor = connection.cursor()
+        cursor.execute(
+            'CREATE TABLE posts_post (id INTEGER PRIMARY KEY, text TEXT, '
+            'pub_date REAL)'
+        )
+        cursor.execute(search.CREATE_TABLE)
+        started = time.monotonic()
+        batch = []
+        for pk, text in enumerate(
+            _texts(options['posts'], options['seed']), 1
+        ):
+            batch.append((pk, text, pk))
+            if len(batch) == 10000:
+                self._insert(cursor, batch)
+                batch = []
+        if batch:
+            self._insert(cursor, batch)
+        connection.commit()
+        self.stdout.write(
+            f'Корпус: {options["posts"]} постов за '
+            f'{time.monotonic() - started:.1f} с, '
+            f'{os.path.getsize(path) / 2 ** 20:.0f} МБ'
+        )
+        page = 10
+        self.stdout.write(
+            f'{"запрос":>20} {"icontains, мс":>14} {"FTS5, мс":>10} '
+            f'{"найдено":>8}'
+        )
+        for query in options['queries']:
+            words = query.split()
+            like = ' AND '.join(['text LIKE ?'] * len(words))
+            like_ms, _ = self._time(
+                cursor,
+                f'SELECT id FROM posts_post WHERE {like} '
+                'ORDER BY pub_date DESC LIMIT ?',
+                [f'%{word}%' for word in words] + [page],
+                options['repeat'],
+            )
+            fts_ms, _ = self._time(
+                cursor,
+                f'SELECT rowid FROM {search.TABLE} '
+                f'WHERE {search.TABLE} MATCH ? ORDER BY rank LIMIT ?',
+                [search.to_match(query), page],
+                options['repeat'],
+            )
+            total = cursor.execute(
+                f'SELECT count(*) FROM {search.TABLE} '
+                f'WHERE {search.TABLE} MATCH ?',
+                [search.to_match(query)],
+            ).fetchone()[0]
+            self.stdout.write(
+                f'{query:>20} {like_ms:>14.1f} {fts_ms:>10.1f} {total:>8}'
+            )
+        connection.close()
+        os.remove(path)
+        os.rmdir(directory)
+
+    def _insert(self, cursor, batch):
+        cursor.executemany(
+            'INSERT INTO posts_post (id, text, pub_date) VALUES (?, ?, ?)',
+            batch,
+        )
+        cursor.executemany(
+            f'INSERT INTO {search.TABLE} (rowid, text) VALUES (?, ?)',
+            [(pk, search.normalize(text)) for pk, text, _ in batch],
+        )
@@ -0,0 +1,103 @@
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import (MemoryFileUploadHandler,
+                                             TemporaryFileUploadHandler)
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from PIL import Image
+
+from posts.forms import PostForm
+from posts.images import normalize
+from posts.uploads import ImageUploadHandler, upload_errors
+
+HANDLERS = {
+    'limited': ImageUploadHandler,
+    'memory': MemoryFileUploadHandler,
+    'temporary': TemporaryFileUploadHandler,
+}
+
+
+def _peak_rss():
+    # На Linux ru_maxrss в килобайтах.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _upload(request, handler, result):
+    """Разбирает, проверяет и пережимает одну загрузку в отдельном
+    процессе, чтобы пик памяти относился только к ней."""
+    started = time.perf_counter()
+    baseline = _peak_rss()
+    request.upload_handlers = [handler(request)]
+    with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=2 ** 40):
+        form = PostForm(
+            request.POST, request.FILES,
+            upload_errors=upload_errors(request),
+        )
+        valid = form.is_valid()
+        if valid:
+            normalize(form.cleaned_data['image'])
+    result.update(
+        valid=valid,
+        errors='; '.join(form.errors.get('image', [])),
+        rss=_peak_rss() - baseline,
+        seconds=time.perf_counter() - started,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пик памяти и время на одну загрузку картинки по обработчикам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels', type=int, nargs='+', default=[1, 12, 60],
+            help='Размеры синтетических картинок',
+        )
+        parser.add_argument(
+            '--handlers', nargs='+', choices=HANDLERS,
+            default=list(HANDLERS),
+        )
+
+    def _request(self, megapixels):
+        side = int((megapixels * 10 ** 6) ** 0.5)
+        buffer = BytesIO()
+        Image.effect_noise((side, side), 64).convert('RGB').save(
+            buffer, 'JPEG', quality=90
+        )
+        data = buffer.getvalue()
+        request = RequestFactory().post('/create/', {
+            'text': 'bench',
+            'image': SimpleUploadedFile('bench.jpg', data, 'image/jpeg'),
+        })
+        return request, len(data)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        manager = context.Manager()
+        self.stdout.write(
+            f'{"МП":>5} {"размер":>10} {"обработчик":>10} '
+            f'{"пик RSS":>10} {"время":>8}  результат'
+        )
+        for megapixels in options['megapixels']:
+            request, size = self._request(megapixels)
+            for name in options['handlers']:
+                result = manager.dict()
+                process = context.Process(
+                    target=_upload, args=(request, HANDLERS[name], result)
+                )
+                process.start()
+                process.join()
+                if not result:
+                    status, rss, seconds = 'упал', 0, 0
+                else:
+                    status = 'принят' if result['valid'] else (
+                        result['errors'] or 'отклонён'
+                    )
+                    rss, seconds = result['rss'], result['seconds']
+                self.stdout.write(
+                    f'{megapixels:>5} {size / 2 ** 20:>8.1f}МБ {name:>10} '
+                    f'{rss / 1024:>8.1f}МБ {seconds:>7.2f}с  {status}'
+                )
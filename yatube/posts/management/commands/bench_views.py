@@ -0,0 +1,342 @@
+import json
+import subprocess
+import time
+from contextlib import contextmanager
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.template.base import Template
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import search
+from posts.models import Follow, Group, Post, UserStats
+from posts.urls import urlpatterns
+
+# Отдельный кэш процесса: прогон не трогает общий кэш страниц.
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-views',
+    }
+}
+
+# Разница меньше этой считается шумом при любом пороге.
+NOISE_MS = 1.0
+
+
+def _percentile(values, percent):
+    """Процентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Probe:
+    """Время и число SQL-запросов и время шаблонов за один запрос.
+
+    Время шаблонов считается по внешнему Template.render, без вложенных
+    include и без SQL, выполненного ленивыми queryset по ходу рендера.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self._depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql += time.perf_counter() - started
+
+    @contextmanager
+    def installed(self):
+        original = Template.render
+        probe = self
+
+        def render(template, context):
+            if probe._depth:
+                return original(template, context)
+            probe._depth += 1
+            started, sql = time.perf_counter(), probe.sql
+            try:
+                return original(template, context)
+            finally:
+                probe._depth -= 1
+                probe.render += (
+                    time.perf_counter() - started - (probe.sql - sql)
+                )
+
+        Template.render = render
+        try:
+            with connection.execute_wrapper(self):
+                yield self
+        finally:
+            Template.render = original
+
+
+class Command(BaseCommand):
+    help = (
+        'Задержка, число и время SQL-запросов и время шаблонов для каждой '
+        'страницы posts на тестовой базе заданного размера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--follows', type=int, default=40000)
+        parser.add_argument('--posts', type=int, default=50000)
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Замеров на каждую страницу',
+        )
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--cache', choices=('cold', 'warm'), default='cold',
+            help='cold — кэш очищается перед каждым запросом',
+        )
+        parser.add_argument(
+            '--routes', nargs='+', metavar='NAME',
+            help='Только эти страницы',
+        )
+        parser.add_argument('--output', default='bench_views.json')
+        parser.add_argument(
+            '--compare', metavar='REPORT',
+            help='Отчёт прошлого прогона для сравнения',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимый рост p95 в долях',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не пересоздавать тестовую базу и не заполнять её снова',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        dataset = {
+            name: options[name]
+            for name in ('users', 'groups', 'follows', 'posts', 'comments')
+        }
+        old_name = connection.settings_dict['NAME']
+        with override_settings(CACHES=BENCH_CACHES, THUMBNAIL_WORKERS=0):
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, keepdb=options['keepdb']
+            )
+            try:
+                if not (options['keepdb'] and Post.objects.exists()):
+                    started = time.monotonic()
+                    call_command(
+                        'seed_yatube', seed=options['seed'],
+                        stdout=StringIO(), **dataset
+                    )
+                    self.stdout.write(
+                        f'База заполнена за {time.monotonic() - started:.0f} с'
+                    )
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(
+                    old_name, verbosity=0, keepdb=options['keepdb']
+                )
+        report = {
+            'commit': _commit(),
+            'created': timezone.now().isoformat(),
+            'dataset': dataset,
+            'requests': options['requests'],
+            'cache': options['cache'],
+            'routes': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Отчёт: {options["output"]}')
+        if options['compare']:
+            self.compare(options['compare'], report, options['threshold'])
+
+    def routes(self):
+        """Страницы posts/urls.py на «тяжёлых» объектах: самый активный
+        автор, самый подписанный читатель, самый обсуждаемый пост."""
+        author = UserStats.objects.select_related('user').order_by(
+            '-posts_count'
+        ).first().user
+        reader = UserStats.objects.select_related('user').order_by(
+            '-following_count'
+        ).first().user
+        post = Post.objects.order_by('-comments_count').first()
+        group = Group.objects.annotate(
+            size=Count('posts')
+        ).order_by('-size').first()
+        word = search.WORD_RE.findall(post.text)[0]
+
+        def follow():
+            Follow.objects.filter(user=reader, author=author).delete()
+
+        def unfollow():
+            Follow.objects.get_or_create(user=reader, author=author)
+
+        return {
+            'main_page': (None, 'get', reverse('posts:main_page'), None),
+            'group_posts_page': (None, 'get', reverse(
+                'posts:group_posts_page', args=[group.slug]
+            ), None),
+            'profile': (reader, 'get', reverse(
+                'posts:profile', args=[author.username]
+            ), None),
+            'post_detail': (None, 'get', reverse(
+                'posts:post_detail', args=[post.pk]
+            ), None),
+            'post_create': (author, 'post', reverse('posts:post_create'), {
+                'text': 'Замер создания поста',
+            }),
+            'post_edit': (post.author, 'get', reverse(
+                'posts:post_edit', args=[post.pk]
+            ), None),
+            'add_comment': (reader, 'post', reverse(
+                'posts:add_comment', args=[post.pk]
+            ), {'text': 'Замер комментария'}),
+            'post_comments': (None, 'get', reverse(
+                'posts:post_comments', args=[post.pk]
+            ), None),
+            'search': (None, 'get', reverse('posts:search') + f'?q={word}',
+                       None),
+            'follow_index': (reader, 'get', reverse('posts:follow_index'),
+                             None),
+            'profile_follow': (reader, 'get', reverse(
+                'posts:profile_follow', args=[author.username]
+            ), follow),
+            'profile_unfollow': (reader, 'get', reverse(
+                'posts:profile_unfollow', args=[author.username]
+            ), unfollow),
+        }
+
+    def run(self, options):
+        routes = self.routes()
+        missing = {
+            pattern.name for pattern in urlpatterns
+        } - set(routes)
+        if missing:
+            self.stderr.write(
+                f'Нет замеров для: {", ".join(sorted(missing))}'
+            )
+        names = options['routes'] or list(routes)
+        unknown = set(names) - set(routes)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные страницы: {", ".join(sorted(unknown))}'
+            )
+        self.stdout.write(
+            f'{"страница":>18} {"p50, мс":>8} {"p95, мс":>8} '
+            f'{"запросов":>8} {"SQL, мс":>8} {"шаблон, мс":>10}'
+        )
+        results = {}
+        probe = Probe()
+        with probe.installed():
+            for name in names:
+                results[name] = self.measure(probe, options, *routes[name])
+                row = results[name]
+                self.stdout.write(
+                    f'{name:>18} {row["p50_ms"]:>8.1f} {row["p95_ms"]:>8.1f} '
+                    f'{row["queries"]:>8} {row["sql_ms"]:>8.1f} '
+                    f'{row["render_ms"]:>10.1f}'
+                )
+        return results
+
+    def measure(self, probe, options, user, method, url, extra):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        data = extra if isinstance(extra, dict) else None
+        prepare = extra if callable(extra) else None
+        samples = []
+        for number in range(options['warmup'] + options['requests']):
+            if prepare is not None:
+                prepare()
+            if options['cache'] == 'cold':
+                cache.clear()
+            probe.reset()
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            elapsed = time.perf_counter() - started
+            if number >= options['warmup']:
+                samples.append(
+                    (elapsed, probe.queries, probe.sql, probe.render)
+                )
+        latency = [sample[0] * 1000 for sample in samples]
+        return {
+            'url': url,
+            'method': method.upper(),
+            'status': response.status_code,
+            'p50_ms': _percentile(latency, 50),
+            'p95_ms': _percentile(latency, 95),
+            'mean_ms': sum(latency) / len(latency),
+            'queries': max(sample[1] for sample in samples),
+            'sql_ms': _percentile([s[2] * 1000 for s in samples], 50),
+            'render_ms': _percentile([s[3] * 1000 for s in samples], 50),
+        }
+
+    def compare(self, path, report, threshold):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        for key in ('dataset', 'cache'):
+            if baseline.get(key) != report[key]:
+                self.stderr.write(
+                    f'Отчёты различаются по {key}, сравнение неточно'
+                )
+        self.stdout.write(
+            f'Сравнение с {baseline.get("commit") or path}: '
+            f'порог p95 +{threshold:.0%}'
+        )
+        regressions = []
+        for name, current in report['routes'].items():
+            previous = baseline['routes'].get(name)
+            if previous is None:
+                continue
+            problems = []
+            grown = current['p95_ms'] - previous['p95_ms']
+            if (
+                grown > NOISE_MS
+                and current['p95_ms'] > previous['p95_ms'] * (1 + threshold)
+            ):
+                problems.append(
+                    f'p95 {previous["p95_ms"]:.1f} → '
+                    f'{current["p95_ms"]:.1f} мс'
+                )
+            if current['queries'] > previous['queries']:
+                problems.append(
+                    f'запросов {previous["queries"]} → {current["queries"]}'
+                )
+            if problems:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: {"; ".join(problems)}'
+                ))
+        if regressions:
+            raise CommandError(
+                f'Регрессии на страницах: {", ".join(regressions)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from core.slow_queries import explain
+
+from posts.feed import FeedPaginator
+from posts.models import Comment, Follow, Group, Post, User, UserStats
+from posts.paginators import CursorPaginator
+
+FULL_SORT = 'USE TEMP B-TREE'
+
+
+def _first_pk(model):
+    return model.objects.values_list('pk', flat=True).first() or 1
+
+
+def _full_sort(plan, bounded):
+    """Есть ли в плане сортировка всех строк. У запросов с bounded
+    сортировка верхнего уровня ограничена строками подзапросов, поэтому
+    проверяются только вложенные строки плана."""
+    return any(
+        FULL_SORT in line and not (bounded and line == line.lstrip())
+        for line in plan.splitlines()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает план выполнения запросов страниц постов и проверяет, '
+        'что ни один из них не сортирует таблицу целиком'
+    )
+
+    def pages(self, name, paginator, cursor):
+        """Запросы, которые выполняют страницы пагинатора по курсору:
+        первая, после курсора, перед курсором и последняя."""
+        yield name, paginator.range_query(), False
+        yield f'{name} (после курсора)', paginator.range_query(cursor), False
+        yield f'{name} (перед курсором)', paginator.range_query(
+            cursor, reverse=True
+        ), False
+        yield f'{name} (последняя)', paginator.range_query(
+            reverse=True
+        ), False
+
+    def feed(self, paginator, cursor):
+        for direction, values, descending in (
+            ('', None, True),
+            (' (после курсора)', cursor, True),
+            (' (перед курсором)', cursor, False),
+        ):
+            queries = paginator.chunk_queries(values, descending)
+            for (_, _, authors), queryset in zip(paginator.sources, queries):
+                source = (
+                    'лента' if authors is None
+                    else f'популярные авторы ({len(authors)})'
+                )
+                # Объединение запросов по авторам сортирует наверху лишь
+                # по пачке строк от каждого автора.
+                yield (
+                    f'follow_index: {source}{direction}', queryset,
+                    authors is not None,
+                )
+
+    def queries(self):
+        user_id = _first_pk(User)
+        group_id = _first_pk(Group)
+        post = Post.objects.first() or Post(pk=1, pub_date=timezone.now())
+        cursor = [post.pub_date, post.pk]
+        pages = {
+            'index': Post.objects.select_related('author', 'group'),
+            'group_posts': Post.objects.filter(
+                group_id=group_id
+            ).select_related('author'),
+            'profile': Post.objects.filter(
+                author_id=user_id
+            ).select_related('group'),
+        }
+        for name, queryset in pages.items():
+            yield from self.pages(
+                name, CursorPaginator(queryset, settings.PAGE_NUMBER), cursor
+            )
+        yield 'profile: подписка', Follow.objects.filter(
+            user_id=user_id, author_id=user_id
+        ), False
+        # Лента самого подписанного читателя: у него больше всего
+        # популярных авторов.
+        reader_id = UserStats.objects.order_by(
+            '-following_count'
+        ).values_list('user_id', flat=True).first() or user_id
+        yield from self.feed(
+            FeedPaginator(User(pk=reader_id), settings.PAGE_NUMBER), cursor
+        )
+        comment = Comment.objects.first() or Comment(
+            pk=1, post_id=post.pk, created=timezone.now()
+        )
+        yield from self.pages(
+            'post_detail: комментарии',
+            CursorPaginator(
+                Comment.objects.filter(post_id=comment.post_id)
+                .select_related('author'),
+                settings.COMMENTS_PAGE_NUMBER, ordering=('created', 'pk'),
+            ),
+            [comment.created, comment.pk],
+        )
+
+    def handle(self, *args, **options):
+        full_sorts = 0
+        for name, queryset, bounded in self.queries():
+            sql, params = queryset.query.sql_with_params()
+            plan = explain(connection, sql, params)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(plan + '\n')
+            if _full_sort(plan, bounded):
+                full_sorts += 1
+                self.stdout.write(self.style.WARNING('Полная сортировка!'))
+        if full_sorts:
+            self.stdout.write(self.style.ERROR(
+                f'Запросов с полной сортировкой: {full_sorts}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'Все запросы читают индекс в нужном порядке'
+            ))
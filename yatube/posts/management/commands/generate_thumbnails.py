@@ -0,0 +1,84 @@
+import os
+import time
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит превью картинок всех постов в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов; 0 — строить в этом процессе',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить уже существующие превью',
+        )
+        parser.add_argument(
+            '--progress', type=int, default=100,
+            help='Печатать прогресс каждые N картинок; 0 — только итог',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 0:
+            raise CommandError('--workers не может быть отрицательным')
+        progress = options['progress']
+        if progress < 0:
+            raise CommandError('--progress не может быть отрицательным')
+        names = sorted({
+            image_web or image
+            for image_web, image in Post.objects.exclude(image='')
+            .values_list('image_web', 'image').iterator()
+        })
+        total = len(names)
+        done = failed = created = 0
+        started = time.monotonic()
+        for name, result in self.results(
+            names, options['workers'], options['force']
+        ):
+            done += 1
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f'{name}: {result}')
+            else:
+                created += result
+            if progress and (done % progress == 0 or done == total):
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{done}/{total} картинок, '
+                    f'{done / elapsed if elapsed else 0:.1f} в секунду'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово превью: {created}, ошибок: {failed}, '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+
+    def results(self, names, workers, force):
+        """Пары (картинка, число построенных превью или ошибка).
+
+        Пул свой, а не общий пул сайта: у того число процессов задано
+        THUMBNAIL_WORKERS.
+        """
+        if not workers:
+            for name in names:
+                try:
+                    yield name, thumbnails.generate(name, force)
+                except Exception as error:
+                    yield name, error
+            return
+        with thumbnails.pool(workers) as pool:
+            futures = {
+                pool.submit(thumbnails.generate, name, force): name
+                for name in names
+            }
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as error:
+                    yield futures[future], error
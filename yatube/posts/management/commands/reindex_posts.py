@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError('Полнотекстовый поиск есть только на SQLite')
+        started = time.monotonic()
+        total = search.reindex()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано постов: {total} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,283 @@
+import multiprocessing
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from faker import Faker
+
+from posts import cache, counters, feed, search, timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+# Сколько строк один процесс вставляет в одной транзакции.
+TASK_SIZE = 50000
+
+# Заполняется до запуска процессов: при fork они получают его готовым.
+_state = {}
+
+
+def _zipf_weights(count, exponent, rng):
+    """Накопленные веса степенного распределения в случайном порядке:
+    немногие получают почти всё, большинство — почти ничего."""
+    weights = [1 / rank ** exponent for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return list(accumulate(weights))
+
+
+@contextmanager
+def _explicit_dates():
+    """Отключает auto_now_add, чтобы bulk_create сохранил заданные даты."""
+    fields = [
+        Post._meta.get_field('pub_date'),
+        Comment._meta.get_field('created'),
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _text(rng, low, high):
+    sentences = _state['sentences']
+    return ' '.join(rng.choices(sentences, k=rng.randint(low, high)))
+
+
+def _users(rng, start, count):
+    prefix, password = _state['prefix'], _state['password']
+    return [
+        User(username=f'{prefix}{number}', password=password)
+        for number in range(start, start + count)
+    ]
+
+
+def _follows(rng, start, count):
+    users, weights = _state['users'], _state['popularity']
+    result = []
+    for _ in range(count):
+        user_id = rng.choice(users)
+        author_id = rng.choices(users, cum_weights=weights)[0]
+        if user_id != author_id:
+            result.append(Follow(user_id=user_id, author_id=author_id))
+    return result
+
+
+def _posts(rng, start, count):
+    """Посты сериями: автор пишет несколько постов подряд с короткими
+    паузами, а между сериями проходят дни."""
+    users, weights = _state['users'], _state['activity']
+    groups, since, span = _state['groups'], _state['since'], _state['span']
+    result = []
+    while len(result) < count:
+        author_id = rng.choices(users, cum_weights=weights)[0]
+        moment = since + rng.random() * span
+        group_id = None
+        if groups and rng.random() < 0.6:
+            group_id = rng.choice(groups)
+        for _ in range(min(int(rng.expovariate(1 / 4)) + 1,
+                           count - len(result))):
+            moment += rng.expovariate(1 / 180)
+            result.append(Post(
+                author_id=author_id,
+                group_id=group_id,
+                text=_text(rng, 1, 6),
+                pub_date=datetime.fromtimestamp(moment, timezone.utc),
+            ))
+    return result
+
+
+def _comments(rng, start, count):
+    posts, dates = _state['posts'], _state['post_dates']
+    weights, users = _state['post_weights'], _state['users']
+    result = []
+    for _ in range(count):
+        index = rng.choices(range(len(posts)), cum_weights=weights)[0]
+        created = dates[index] + rng.expovariate(1 / 7200)
+        result.append(Comment(
+            post_id=posts[index],
+            author_id=rng.choice(users),
+            text=_text(rng, 1, 2),
+            created=datetime.fromtimestamp(created, timezone.utc),
+        ))
+    return result
+
+
+BUILDERS = {
+    'users': (User, _users),
+    'follows': (Follow, _follows),
+    'posts': (Post, _posts),
+    'comments': (Comment, _comments),
+}
+
+
+def _init_worker():
+    connections.close_all()
+
+
+def _run_task(task):
+    kind, start, count, seed = task
+    model, build = BUILDERS[kind]
+    rows = build(random.Random(seed), start, count)
+    # Django 2.2 не урезает явный batch_size до предела бэкенда, а SQLite
+    # больше 500 строк в одном INSERT не принимает.
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    batch_size = min(
+        _state['batch_size'], connection.ops.bulk_batch_size(fields, rows)
+    )
+    with transaction.atomic():
+        model.objects.bulk_create(
+            rows, batch_size=batch_size, ignore_conflicts=True
+        )
+    return len(rows)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу данными для нагрузочных тестов: степенное '
+        'распределение подписчиков и посты сериями'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--follows', type=int, default=200000)
+        parser.add_argument('--posts', type=int, default=200000)
+        parser.add_argument('--comments', type=int, default=500000)
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней раскидать посты',
+        )
+        parser.add_argument('--prefix', default='seed_user')
+        parser.add_argument(
+            '--password', default='password',
+            help='Пароль всех созданных пользователей',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Процессов для вставки; SQLite пишет только одним',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            raise CommandError(
+                'SQLite не пишет из нескольких процессов, --workers 1'
+            )
+        rng = random.Random(options['seed'])
+        fake = Faker('ru_RU')
+        fake.seed_instance(options['seed'])
+        _state.update(
+            batch_size=options['batch_size'],
+            prefix=options['prefix'],
+            password=make_password(options['password']),
+            sentences=[fake.sentence(nb_words=12) for _ in range(5000)],
+        )
+        self.started = time.monotonic()
+        self.seed = options['seed']
+
+        self._stage('users', options['users'], workers, start=(
+            User.objects.filter(
+                username__startswith=options['prefix']
+            ).count()
+        ))
+        users = array('q', User.objects.order_by('pk').values_list(
+            'pk', flat=True
+        ).iterator())
+        if not users:
+            raise CommandError('Нет пользователей')
+        Group.objects.bulk_create(
+            [
+                Group(
+                    title=fake.catch_phrase()[:200],
+                    slug=f'seed-{options["seed"]}-{number}',
+                    description=fake.paragraph(),
+                )
+                for number in range(options['groups'])
+            ],
+            ignore_conflicts=True,
+        )
+        now = time.time()
+        _state.update(
+            users=users,
+            popularity=_zipf_weights(len(users), 1.1, rng),
+            activity=_zipf_weights(len(users), 0.8, rng),
+            groups=list(Group.objects.values_list('pk', flat=True)),
+            since=now - options['days'] * 86400,
+            span=options['days'] * 86400,
+        )
+        self._stage('follows', options['follows'], workers)
+        with _explicit_dates():
+            self._stage('posts', options['posts'], workers)
+            posts, dates = array('q'), array('d')
+            for pk, pub_date in Post.objects.order_by().values_list(
+                'pk', 'pub_date'
+            ).iterator():
+                posts.append(pk)
+                dates.append(pub_date.timestamp())
+            if posts:
+                _state.update(
+                    posts=posts,
+                    post_dates=dates,
+                    post_weights=_zipf_weights(len(posts), 1.0, rng),
+                )
+                self._stage('comments', options['comments'], workers)
+        self._finish()
+
+    def _stage(self, kind, total, workers, start=0):
+        started = time.monotonic()
+        tasks = [
+            (kind, start + offset, min(TASK_SIZE, total - offset),
+             f'{self.seed}:{kind}:{offset}')
+            for offset in range(0, total, TASK_SIZE)
+        ]
+        if workers > 1:
+            context = multiprocessing.get_context('fork')
+            connections.close_all()
+            with context.Pool(workers, initializer=_init_worker) as pool:
+                done = sum(pool.imap_unordered(_run_task, tasks))
+        else:
+            done = sum(map(_run_task, tasks))
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{kind}: {done} строк за {elapsed:.1f} с '
+            f'({done / elapsed if elapsed else 0:.0f} в секунду)'
+        )
+
+    def _finish(self):
+        """Всё, что при обычной работе поддерживают сигналы."""
+        steps = (
+            ('счётчики', counters.reconcile),
+            ('популярные авторы', feed.reset_celebrities),
+            ('ленты', timeline.rebuild),
+            ('поиск', search.reindex if search.available() else None),
+            ('статистика базы', self._analyze),
+            ('кэш страниц', lambda: cache.bump_pages('all')),
+        )
+        for name, step in steps:
+            if step is None:
+                continue
+            started = time.monotonic()
+            step()
+            self.stdout.write(
+                f'{name}: {time.monotonic() - started:.1f} с'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - self.started:.1f} с'
+        ))
+
+    def _analyze(self):
+        # Оценки числа строк в админке берутся из этой статистики.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
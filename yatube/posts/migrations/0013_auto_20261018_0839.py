@@ -0,0 +1,54 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:39
+
+from collections import Counter
+
+from django.db import migrations, models
+import posts.storage
+
+
+def count_references(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ImageBlob = apps.get_model('posts', 'ImageBlob')
+    references = Counter()
+    for names in Post.objects.values_list('image', 'image_web').iterator():
+        references.update(name for name in names if name)
+    ImageBlob.objects.bulk_create(
+        [
+            ImageBlob(name=name, references=total)
+            for name, total in references.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_auto_20261018_0835'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Путь')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл картинки',
+                'verbose_name_plural': 'Файлы картинок',
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image_web',
+            field=models.ImageField(blank=True, editable=False, height_field='image_height', storage=posts.storage.ContentAddressedStorage(), upload_to='posts/web/', verbose_name='Картинка для показа', width_field='image_width'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:41
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts USING fts5('
+            "text, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.executemany(
+            'INSERT INTO posts_post_fts (rowid, text) VALUES (%s, %s)',
+            [
+                (pk, text.replace('ё', 'е').replace('Ё', 'Е'))
+                for pk, text in Post.objects.values_list('pk', 'text')
+                .iterator()
+            ],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_auto_20261018_0839'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+
+from .storage import content_storage
 
 User = get_user_model()
 
@@ -52,17 +54,82 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=content_storage,
         blank=True
     )
+    image_web = models.ImageField(
+        'Картинка для показа',
+        upload_to='posts/web/',
+        storage=content_storage,
+        blank=True,
+        editable=False,
+        width_field='image_width',
+        height_field='image_height'
+    )
+    image_width = models.PositiveIntegerField(
+        'Ширина', null=True, editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота', null=True, editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер файла', null=True, editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # id в конце индекса — второй ключ keyset-пагинации.
+        indexes = (
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_date_idx',
+            ),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_date_idx',
+            ),
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='post_date_idx',
+            ),
+        )
 
     def __str__(self) -> str:
         return self.text[:settings.TEXT_SIZE_NUMBER]
 
+    @property
+    def display_image(self):
+        """Пережатая копия картинки, а для старых постов — оригинал."""
+        return self.image_web or self.image
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        # Счётчик комментариев меняют только сигналы: сохранение
+        # загруженного ранее поста не должно затирать его старым значением.
+        # Отложенные поля не загружены — их тоже не пишем.
+        if (
+            not self._state.adding and not force_insert
+            and update_fields is None
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name != 'comments_count'
+                and field.attname not in deferred
+            ]
+        # Счётчики, которые меняют обработчики post_save, — в одной
+        # транзакции с постом.
+        with transaction.atomic(using=using):
+            super().save(force_insert, force_update, using, update_fields)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -89,10 +156,21 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = (
+            models.Index(
+                fields=('post', 'created'),
+                name='comment_post_created_idx',
+            ),
+        )
 
     def __str__(self):
         return self.text[:settings.TEXT_SIZE_NUMBER]
 
+    def save(self, *args, **kwargs):
+        # Счётчик комментариев поста — в одной транзакции с комментарием.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -109,3 +187,100 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'author'),
+                name='follow_unique_user_author',
+            ),
+        )
+
+    def save(self, *args, **kwargs):
+        # Счётчики подписок и лента — в одной транзакции с подпиской.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class TimelineEntry(models.Model):
+    """Пост автора, разложенный в ленту подписчика при публикации."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='timeline_user_date_idx',
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx',
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='timeline_unique_user_post',
+            ),
+        )
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые поддерживают сигналы."""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков',
+        default=0,
+        db_index=True
+    )
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return str(self.user)
+
+
+class ImageBlob(models.Model):
+    """Файл в хранилище по содержимому и число постов, которые на него
+    ссылаются."""
+
+    name = models.CharField('Путь', max_length=255, unique=True)
+    references = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
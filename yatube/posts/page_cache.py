@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import secrets
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, quote_etag
+
+from core import instrumentation
+
+from .conditional import get_validators
+
+logger = logging.getLogger(__name__)
+
+# Счётчики процесса: hit, stale, recompute, stampede по префиксам.
+STATS = Counter()
+
+
+def _cache_key(key_prefix, request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page_cache:{key_prefix}:{path}'
+
+
+def _release(lock_key, token):
+    # Блокировка могла истечь и достаться другому запросу: снимается
+    # только своя. Сравнение и удаление не атомарны, но окно между ними
+    # много меньше PAGE_CACHE_LOCK_TIMEOUT.
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _stamp(response, validators):
+    # Копия несёт свои валидаторы: condition() лишь дополняет заголовки,
+    # и устаревшая копия не получит ETag текущей версии страницы.
+    etag, last_modified = validators
+    response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+
+
+def _outcome(key_prefix, outcome):
+    STATS[f'{key_prefix}:{outcome}'] += 1
+    instrumentation.mark('page', f'{key_prefix}:{outcome}')
+
+
+def _cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+    )
+
+
+def cached_page(scope_func, key_prefix):
+    """Кэш страницы с защитой от лавины запросов.
+
+    Кэшируются только страницы анонимных посетителей: копия одна на
+    всех, а страница вошедшего пользователя зависит от него самого.
+    Свежесть записи определяет ETag страницы (см. conditional), поэтому
+    изменения видны сразу. Пересчитывает страницу только запрос, взявший
+    блокировку; остальные в это время получают прежнюю копию, пока ей не
+    больше PAGE_CACHE_TIMEOUT + PAGE_CACHE_GRACE секунд.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if (
+                request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated
+            ):
+                return view(request, *args, **kwargs)
+            validators = get_validators(request, scope_func, *args, **kwargs)
+            if validators is None:
+                return view(request, *args, **kwargs)
+            key = _cache_key(key_prefix, request)
+            entry = cache.get(key)
+            age = time.time() - entry['created'] if entry else None
+            if (
+                entry and entry['etag'] == validators[0]
+                and age < settings.PAGE_CACHE_TIMEOUT
+            ):
+                _outcome(key_prefix, 'hit')
+                return entry['response']
+            lock_key = f'{key}:lock'
+            token = secrets.token_hex(16)
+            if not cache.add(
+                lock_key, token, settings.PAGE_CACHE_LOCK_TIMEOUT
+            ):
+                if entry and age < (
+                    settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_GRACE
+                ):
+                    _outcome(key_prefix, 'stale')
+                    return entry['response']
+                _outcome(key_prefix, 'stampede')
+                logger.warning(
+                    'Страница %s пересчитывается параллельно: '
+                    'нет копии в пределах окна',
+                    request.path,
+                )
+                return view(request, *args, **kwargs)
+            try:
+                _outcome(key_prefix, 'recompute')
+                response = view(request, *args, **kwargs)
+                if _cacheable(response):
+                    _stamp(response, validators)
+                    cache.set(key, {
+                        'etag': validators[0],
+                        'created': time.time(),
+                        'response': response,
+                    }, settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_GRACE)
+                return response
+            finally:
+                _release(lock_key, token)
+        return wrapped
+    return decorator
@@ -0,0 +1,259 @@
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.encoding import force_bytes, force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+CURSOR_SEPARATOR = '|'
+
+# Параметры запроса, которыми выбирается страница.
+CURSOR_PARAMS = ('after', 'before', 'last', 'page')
+
+
+def keyset_filter(fields, values, descending=True):
+    """Условие «строго после values» для сортировки по fields.
+
+    Лишнее на первый взгляд нестрогое условие по первому полю даёт
+    планировщику границу диапазона, и индекс читается с курсора,
+    а не с начала.
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for index, name in enumerate(fields):
+        equal = dict(zip(fields[:index], values[:index]))
+        equal[f'{name}__{lookup}'] = values[index]
+        condition |= Q(**equal)
+    return Q(**{f'{fields[0]}__{lookup}e': values[0]}) & condition
+
+
+class CursorPage(Page):
+    """Страница, для которой соседи известны без COUNT(*).
+
+    У страницы по курсору нет номера: number равен None, и методы,
+    которым нужны номер или общее число строк, недоступны.
+    """
+
+    def __init__(self, object_list, number, paginator,
+                 has_next=None, has_previous=None):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        if self.number is None:
+            return f'<Page of {len(self)} objects by cursor>'
+        return super().__repr__()
+
+    def _numbered(self, method, *args):
+        if self.number is None:
+            raise TypeError(
+                f'{method.__name__}() недоступен у страницы по курсору'
+            )
+        return method(self, *args)
+
+    def has_next(self):
+        if self._has_next is None:
+            return super().has_next()
+        return self._has_next
+
+    def has_previous(self):
+        if self._has_previous is None:
+            return super().has_previous()
+        return self._has_previous
+
+    def next_page_number(self):
+        return self._numbered(Page.next_page_number)
+
+    def previous_page_number(self):
+        return self._numbered(Page.previous_page_number)
+
+    def start_index(self):
+        return self._numbered(Page.start_index)
+
+    def end_index(self):
+        return self._numbered(Page.end_index)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next() or not len(self):
+            return ''
+        return self.paginator.encode_cursor(self[len(self) - 1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous() or not len(self):
+            return ''
+        return self.paginator.encode_cursor(self[0])
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по упорядоченному набору полей.
+
+    Вместо LIMIT/OFFSET страница выбирается условием «строго после
+    курсора» по тем же полям, по которым идёт сортировка, поэтому
+    любая страница стоит одного диапазонного прохода по индексу.
+    Все поля ordering должны сортироваться в одну сторону.
+    """
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-pk'), **kwargs):
+        self.ordering = tuple(ordering)
+        self.fields = tuple(name.lstrip('-') for name in self.ordering)
+        self.descending = self.ordering[0].startswith('-')
+        super().__init__(
+            object_list.order_by(*self.ordering), per_page, **kwargs
+        )
+
+    def _get_page(self, *args, **kwargs):
+        return CursorPage(*args, **kwargs)
+
+    def encode_cursor(self, obj):
+        values = []
+        for name in self.fields:
+            value = getattr(obj, name)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(str(value))
+        return urlsafe_base64_encode(
+            force_bytes(CURSOR_SEPARATOR.join(values))
+        )
+
+    def decode_cursor(self, cursor):
+        """Возвращает значения ключа или None для битого курсора."""
+        if not cursor:
+            return None
+        try:
+            raw = force_str(urlsafe_base64_decode(cursor))
+        except (ValueError, TypeError):
+            return None
+        parts = raw.split(CURSOR_SEPARATOR)
+        if len(parts) != len(self.fields):
+            return None
+        opts = self.object_list.model._meta
+        values = []
+        for name, part in zip(self.fields, parts):
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            try:
+                values.append(field.to_python(part))
+            except Exception:
+                return None
+        return values
+
+    def _beyond(self, values, reverse=False):
+        return keyset_filter(
+            self.fields, values, self.descending != reverse
+        )
+
+    def _reversed_ordering(self):
+        return tuple(
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        )
+
+    def _fetched(self, queryset, rows):
+        """QuerySet страницы с уже прочитанными строками: код, которому
+        нужен QuerySet (count(), exists()), не делает второго запроса."""
+        queryset._result_cache = rows
+        queryset._prefetch_done = True
+        return queryset
+
+    def _range(self, values=None, reverse=False):
+        object_list = self.object_list
+        if values is not None:
+            object_list = object_list.filter(self._beyond(values, reverse))
+        return object_list
+
+    def range_query(self, values=None, reverse=False):
+        """Запрос, которым читается страница: per_page + 1 строк после
+        курсора, а при reverse — перед ним в обратном порядке."""
+        object_list = self._range(values, reverse)
+        if reverse:
+            object_list = object_list.order_by(*self._reversed_ordering())
+        return object_list[:self.per_page + 1]
+
+    def page_after(self, values=None):
+        """Страница после курсора одним диапазонным запросом: лишняя
+        строка в выборке показывает, есть ли следующая страница."""
+        rows = list(self.range_query(values))
+        return self._get_page(
+            self._fetched(
+                self._range(values)[:self.per_page], rows[:self.per_page]
+            ),
+            None, self,
+            has_next=len(rows) > self.per_page,
+            has_previous=values is not None,
+        )
+
+    def page_before(self, values=None):
+        """Страница перед курсором; без курсора — последняя страница.
+
+        Строки читаются одним запросом в обратном порядке.
+        """
+        rows = list(self.range_query(values, reverse=True))
+        if not rows:
+            return self.page_after()
+        page = rows[:self.per_page]
+        page.reverse()
+        first = [getattr(page[0], name) for name in self.fields]
+        object_list = self._range(values, reverse=True).exclude(
+            self._beyond(first, reverse=True)
+        )
+        return self._get_page(
+            self._fetched(object_list[:self.per_page], page), None, self,
+            has_next=values is not None,
+            has_previous=len(rows) > self.per_page,
+        )
+
+    def get_cursor_page(self, after=None, before=None, last=False):
+        """Как get_page(): некорректный курсор даёт первую страницу."""
+        if before is not None or last:
+            values = self.decode_cursor(before)
+            if values is not None or last:
+                return self.page_before(values)
+        return self.page_after(self.decode_cursor(after))
+
+
+def estimate_rows(model, using='default'):
+    """Число строк таблицы по статистике базы или None, если её нет.
+
+    Для SQLite статистику собирает ANALYZE, для PostgreSQL — autovacuum.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        'sqlite': 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+        'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+    }
+    if connection.vendor not in queries:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(queries[connection.vendor], [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None:
+        return None
+    # В sqlite_stat1 первое число — строк в таблице или индексе.
+    return int(float(str(row[0]).split()[0]))
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор для больших таблиц без полного COUNT(*).
+
+    Без фильтров число строк берётся из статистики базы, с фильтрами
+    считается не дальше ESTIMATED_COUNT_LIMIT строк: дальше этой границы
+    страницы всё равно никто не листает.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ESTIMATED_COUNT_LIMIT
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
@@ -0,0 +1,170 @@
+import re
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+TABLE = 'posts_post_fts'
+
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+    "text, tokenize='unicode61 remove_diacritics 2')"
+)
+
+# Границы совпадения в тексте из FTS5: в постах таких символов не бывает,
+# поэтому их можно заменить на теги уже после экранирования HTML.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+SNIPPET_TOKENS = 48
+
+WORD_RE = re.compile(r'\w+')
+
+
+def available(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def normalize(text):
+    # unicode61 не считает «ё» вариантом «е».
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def to_match(query):
+    """Запрос пользователя как выражение MATCH: все слова обязательны,
+    последнее ищется по префиксу. Синтаксис FTS5 из запроса не
+    пропускается."""
+    words = WORD_RE.findall(normalize(query))
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' AND '.join(terms)
+
+
+def filter_posts(queryset, query):
+    """Посты из queryset, подходящие под запрос, по индексу."""
+    match = to_match(query)
+    if match is None:
+        return queryset.none()
+    # pk__in=RawSQL(...) дал бы IN ((SELECT ...)), а SQLite читает это
+    # как скалярный подзапрос и берёт из него одну строку.
+    return queryset.extra(
+        where=[
+            f'{Post._meta.db_table}.id IN '
+            f'(SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s)'
+        ],
+        params=[match],
+    )
+
+
+def index(post):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, normalize(post.text)],
+        )
+
+
+def unindex(post_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+
+
+def reindex(batch_size=2000):
+    """Строит индекс заново по таблице постов; возвращает число постов."""
+    total = 0
+    # Одна транзакция: иначе executemany в режиме автофиксации
+    # фиксирует каждую строку отдельно.
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        posts = Post.objects.order_by().values_list('pk', 'text')
+        batch = []
+        for pk, text in posts.iterator(chunk_size=batch_size):
+            batch.append((pk, normalize(text)))
+            if len(batch) == batch_size:
+                cursor.executemany(
+                    f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)',
+                    batch,
+                )
+                total += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)', batch
+            )
+            total += len(batch)
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def highlight(snippet):
+    """Фрагмент с совпадениями в <mark>; всё остальное экранируется."""
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+class SearchResults:
+    """Результаты поиска по релевантности (bm25), годные для Paginator.
+
+    Paginator нужны только count() и срез: срез читает из индекса одну
+    страницу номеров и фрагментов, а посты догружает одним запросом.
+    """
+
+    def __init__(self, query):
+        self.match = to_match(query) if available() else None
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = 0
+            if self.match:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'SELECT count(*) FROM {TABLE} '
+                        f'WHERE {TABLE} MATCH %s',
+                        [self.match],
+                    )
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        if not self.match or stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, snippet({TABLE}, 0, %s, %s, %s, %s) '
+                f'FROM {TABLE} WHERE {TABLE} MATCH %s '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                [MARK_START, MARK_END, '…', SNIPPET_TOKENS,
+                 self.match, stop - start, start],
+            )
+            rows = cursor.fetchall()
+        posts = Post.objects.select_related(
+            'author', 'group'
+        ).in_bulk([pk for pk, _ in rows])
+        results = []
+        for pk, snippet in rows:
+            post = posts.get(pk)
+            # Пост могли удалить между чтением индекса и таблицы.
+            if post is not None:
+                post.highlight = highlight(snippet)
+                results.append(post)
+        return results
@@ -0,0 +1,145 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import blobs, cache, counters, feed, search, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def _post_pages(post, *group_ids):
+    cache.bump_pages(
+        'index',
+        f'post:{post.pk}',
+        f'profile:{post.author_id}',
+        *(f'group:{group_id}' for group_id in group_ids if group_id),
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    if raw:
+        return
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif update_fields is None or set(update_fields) != {'last_login'}:
+        cache.bump('author', instance.pk)
+        cache.bump_pages('all')
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        cache.bump('group', instance.pk)
+        cache.bump_pages('all')
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Ссылку на только что загруженный файл уже взяло хранилище.
+    instance._uploaded = {
+        field for field in ('image', 'image_web')
+        if getattr(instance, field)
+        and not getattr(instance, field)._committed
+    }
+    if not instance._state.adding:
+        # Пост мог уйти из группы: её страница тоже изменилась.
+        (
+            instance._previous_group_id,
+            instance._previous_image,
+            instance._previous_image_web,
+            instance._previous_text,
+        ) = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image', 'image_web', 'text'
+        ).first() or (None, None, None, None)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    cache.bump('post', instance.pk)
+    _post_pages(
+        instance,
+        instance.group_id,
+        getattr(instance, '_previous_group_id', None),
+    )
+    if instance.text != getattr(instance, '_previous_text', None):
+        search.index(instance)
+    if instance.image.name != getattr(instance, '_previous_image', None):
+        thumbnails.schedule(instance)
+    with transaction.atomic():
+        for field in ('image', 'image_web'):
+            name = getattr(instance, field).name
+            previous = getattr(instance, f'_previous_{field}', None)
+            uploaded = field in getattr(instance, '_uploaded', ())
+            if name == previous and not uploaded:
+                continue
+            if not uploaded:
+                blobs.retain(name)
+            blobs.release(previous)
+    if not created:
+        return
+    counters.change_user(instance.author_id, 'posts_count', 1)
+    if not feed.is_celebrity(instance.author_id):
+        timeline.fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    cache.bump('post', instance.pk)
+    _post_pages(instance, instance.group_id)
+    counters.change_user(instance.author_id, 'posts_count', -1)
+    search.unindex(instance.pk)
+    blobs.release(instance.image.name)
+    blobs.release(instance.image_web.name)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_post_comments(instance.post_id, 1)
+        cache.bump_pages(f'post:{instance.post_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_post_comments(instance.post_id, -1)
+    cache.bump_pages(f'post:{instance.post_id}')
+
+
+def _follow_pages(follow):
+    cache.bump_pages(
+        f'profile:{follow.author_id}', f'profile:{follow.user_id}'
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    with transaction.atomic():
+        followers = counters.change_user(
+            instance.author_id, 'followers_count', 1
+        )
+        counters.change_user(instance.user_id, 'following_count', 1)
+        timeline.reclassify(instance.author_id, followers, 1)
+        if followers <= settings.FEED_FANOUT_THRESHOLD:
+            timeline.backfill(instance.user_id, instance.author_id)
+    _follow_pages(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    with transaction.atomic():
+        followers = counters.change_user(
+            instance.author_id, 'followers_count', -1
+        )
+        counters.change_user(instance.user_id, 'following_count', -1)
+        timeline.prune(instance.user_id, instance.author_id)
+        if followers is not None:
+            timeline.reclassify(instance.author_id, followers, -1)
+    _follow_pages(instance)
@@ -0,0 +1,46 @@
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы называются по SHA-256 содержимого.
+
+    Одинаковые загрузки ложатся в один файл, а раз имя источника то же,
+    то и превью sorl у них общие. Каталог из upload_to и расширение
+    сохраняются: posts/photo.jpg становится posts/ab/ab12….jpg.
+    Удалять такие файлы можно только через счётчик ссылок в blobs, и
+    ссылку save() берёт сам, до проверки, лежит ли файл на месте: иначе
+    collect() от удаления последнего поста с той же картинкой успел бы
+    стереть файл между save() и post_save нового поста.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        hexdigest = digest.hexdigest()
+        return posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        from . import blobs  # blobs сам импортирует хранилище
+        blobs.retain(name)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,16 @@
+from django import template
+
+from ..paginators import CURSOR_PARAMS
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cursor_query(context, **params):
+    """Строка запроса страницы по курсору с остальными параметрами
+    текущего запроса: {% cursor_query after=page_obj.next_cursor %}."""
+    query = context['request'].GET.copy()
+    for name in CURSOR_PARAMS:
+        query.pop(name, None)
+    query.update(params)
+    return f'?{query.urlencode()}'
@@ -0,0 +1,13 @@
+from django import template
+
+from ..cache import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Карточки постов страницы: {% post_cards page_obj as cards %}."""
+    return render_cards(
+        posts, author=context.get('author'), group=context.get('group')
+    )
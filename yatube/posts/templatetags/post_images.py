@@ -0,0 +1,16 @@
+from django import template
+
+from .. import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(post):
+    """Превью картинки поста с srcset: {% post_image post %}."""
+    if not post.display_image:
+        return {}
+    return {
+        'srcset': thumbnails.complete(post),
+        'image': post.thumbnail,
+    }
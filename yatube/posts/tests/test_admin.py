@@ -0,0 +1,62 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Group, Post, User
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        cls.group = Group.objects.create(
+            title='Test title', slug='test', description='Test description'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_posts(self, count):
+        for number in range(count):
+            post = Post.objects.create(
+                author=self.admin, group=self.group, text=f'Post {number}'
+            )
+            Comment.objects.create(
+                post=post, author=self.admin, text=f'Comment {number}'
+            )
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:posts_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Число запросов списка не зависит от числа строк"""
+        for model in ('post', 'comment'):
+            with self.subTest(model=model):
+                self.create_posts(2)
+                few = self.changelist_queries(model)
+                self.create_posts(8)
+                self.assertEqual(self.changelist_queries(model), few)
+
+    @override_settings(ESTIMATED_COUNT_LIMIT=3)
+    def test_filtered_count_is_capped(self):
+        """С фильтром строки считаются не дальше границы"""
+        self.create_posts(5)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'post'}
+        )
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_comment_search_by_author(self):
+        """Комментарии ищутся по имени автора"""
+        self.create_posts(1)
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'admin'}
+        )
+        self.assertEqual(response.context['cl'].result_count, 1)
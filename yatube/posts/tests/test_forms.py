@@ -1,15 +1,26 @@
+import os
 import tempfile
 import shutil
+from hashlib import sha256
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase, override_settings
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
 
 from http import HTTPStatus
 
-from ..models import Comment, Group, Post, User
+from .. import blobs, thumbnails
+from ..models import Comment, Group, ImageBlob, Post, User
+from ..storage import content_storage
 
 User = get_user_model()
 
@@ -45,6 +56,7 @@ class CreatinoFormTest(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
         self.another_client = Client()
@@ -81,12 +93,116 @@ class CreatinoFormTest(TestCase):
         self.assertEqual(post_created.text, form_data['text'])
         self.assertEqual(post_created.group, self.group)
         self.assertEqual(post_created.author, self.user)
-        self.assertEqual(post_created.image, 'posts/small.gif')
+        digest = sha256(small_gif).hexdigest()
+        self.assertEqual(
+            post_created.image, f'posts/{digest[:2]}/{digest}.gif'
+        )
         self.assertRedirects(response, reverse(
             'posts:profile', args=(post_created.author,)
         )
         )
 
+    @override_settings(IMAGE_MAX_SIDE=300, IMAGE_WEB_FORMATS=('WEBP',))
+    def test_uploaded_image_normalized(self):
+        """Рядом с оригиналом хранится уменьшенная копия без EXIF"""
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        Image.new('RGB', (600, 200), 'red').save(
+            buffer, 'JPEG', exif=exif.tobytes()
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Photo',
+                'image': SimpleUploadedFile(
+                    'photo.jpg', buffer.getvalue(), content_type='image/jpeg'
+                )
+            }
+        )
+        post = Post.objects.get(text='Photo')
+        self.assertRegex(post.image.name, r'^posts/\w\w/\w{64}\.jpg$')
+        self.assertRegex(post.image_web.name, r'^posts/web/\w\w/\w{64}\.webp$')
+        self.assertEqual((post.image_width, post.image_height), (300, 100))
+        self.assertEqual(post.image_size, post.image_web.size)
+        with Image.open(post.image_web) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertFalse(image.getexif())
+
+    def test_stored_original_without_metadata(self):
+        """В хранимом оригинале нет EXIF, поворот перенесён в пиксели"""
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {0x0001: 'N', 0x0002: (55.0, 45.0, 0.0)}
+        Image.new('RGB', (60, 20), 'red').save(
+            buffer, 'JPEG', exif=exif.tobytes()
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Geotagged',
+                'image': SimpleUploadedFile(
+                    'geo.jpg', buffer.getvalue(), content_type='image/jpeg'
+                )
+            }
+        )
+        post = Post.objects.get(text='Geotagged')
+        with Image.open(post.image) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertFalse(image.getexif())
+            self.assertEqual(image.size, (20, 60))
+        self.assertEqual((post.image_width, post.image_height), (20, 60))
+
+    def test_oversized_uploads_rejected(self):
+        """Слишком большие файлы и картинки отвергаются до декодирования"""
+        buffer = BytesIO()
+        Image.new('RGB', (600, 200), 'red').save(buffer, 'JPEG')
+        limits = (
+            {'IMAGE_UPLOAD_MAX_BYTES': 100},
+            {'IMAGE_UPLOAD_MAX_PIXELS': 600 * 200 - 1},
+        )
+        for limit in limits:
+            with self.subTest(limit=limit), override_settings(**limit):
+                response = self.authorized_client.post(
+                    reverse('posts:post_create'),
+                    data={
+                        'text': 'Huge photo',
+                        'image': SimpleUploadedFile(
+                            'huge.jpg', buffer.getvalue(),
+                            content_type='image/jpeg'
+                        )
+                    }
+                )
+                self.assertTrue(response.context['form'].has_error('image'))
+                self.assertFalse(
+                    Post.objects.filter(text='Huge photo').exists()
+                )
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_thumbnails_pregenerated(self):
+        """Превью картинки строятся заранее и лежат в KV-хранилище"""
+        post = Post.objects.create(
+            text='Text with image',
+            author=self.user,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=(
+                    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                    b'\x0A\x00\x3B'
+                ),
+                content_type='image/gif'
+            )
+        )
+        source = ImageFile(post.image)
+        self.assertIsNone(default.kvstore.get(source))
+        thumbnails.submit(post.image.name)
+        self.assertIsNotNone(default.kvstore.get(source))
+
     def test_valid_form_edit_post(self):
         """Валидная форма редактирует пост"""
         post_count = Post.objects.count()
@@ -171,3 +287,63 @@ class CreatinoFormTest(TestCase):
             ).count(), comments_count + 1
         )
         self.assertEqual(self.post.comments.get(pk=1).text, form_data['text'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ImageStorageTest(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tester')
+        buffer = BytesIO()
+        Image.new('RGB', (60, 20), 'blue').save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+
+    def create_post(self, text):
+        return Post.objects.create(
+            author=self.user,
+            text=text,
+            image=SimpleUploadedFile(
+                f'{text}.png', self.content, content_type='image/png'
+            )
+        )
+
+    def test_identical_uploads_share_file(self):
+        """Одинаковые картинки хранятся одним файлом до последней ссылки"""
+        first = self.create_post('first')
+        second = self.create_post('second')
+        self.assertEqual(first.image.name, second.image.name)
+        path = first.image.path
+        blob = ImageBlob.objects.get(name=first.image.name)
+        self.assertEqual(blob.references, 2)
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.image = None
+        second.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_reupload_survives_pending_collect(self):
+        """Файл, загруженный заново, не удаляет сборка от прошлого поста"""
+        first = self.create_post('first')
+        name, path = first.image.name, first.image.path
+        with mock.patch.object(blobs, 'collect'):
+            first.delete()
+        exists = content_storage.exists
+
+        def exists_then_collect(checked):
+            # Сборка после удаления успевает между save() и post_save.
+            found = exists(checked)
+            blobs.collect(checked)
+            return found
+
+        with mock.patch.object(
+            content_storage, 'exists', side_effect=exists_then_collect
+        ):
+            second = self.create_post('second')
+        self.assertEqual(second.image.name, name)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ImageBlob.objects.get(name=name).references, 1)
@@ -1,8 +1,19 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count, Min, QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from ..models import Group, Post
+from ..management.commands import seed_yatube
+from ..models import (Comment, Follow, Group, Post, TimelineEntry,
+                      UserStats)
 
 User = get_user_model()
 
@@ -55,3 +66,147 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text, ht
                 )
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def test_counters_follow_changes(self):
+        """Сигналы поддерживают счётчики в актуальном состоянии"""
+        post = Post.objects.create(author=self.author, text='Текст')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 1
+        )
+        follow.delete()
+        post.delete()
+        author_stats.refresh_from_db()
+        self.assertEqual(author_stats.posts_count, 0)
+        self.assertEqual(author_stats.followers_count, 0)
+
+    def test_user_with_posts_and_follows_deleted(self):
+        """Пользователь с постами и подписками удаляется, строка
+        счётчиков для него не появляется снова"""
+        user = User.objects.create_user(username='leaving')
+        Post.objects.create(author=user, text='Текст')
+        Follow.objects.create(user=user, author=self.author)
+        Follow.objects.create(user=self.reader, author=user)
+        user.delete()
+        self.assertFalse(UserStats.objects.filter(user_id=user.pk).exists())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 0
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 0
+        )
+
+    def test_post_save_keeps_comments_count(self):
+        """Редактирование поста не затирает счётчик комментариев"""
+        post = Post.objects.create(author=self.author, text='Текст')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        post.text = 'Новый текст'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_post_save_skips_deferred_fields(self):
+        """Сохранение поста с отложенными полями не пишет их"""
+        group = Group.objects.create(title='Группа', slug='group')
+        post = Post.objects.create(
+            author=self.author, text='Текст', group=group
+        )
+        partial = Post.objects.only('pk', 'text').get(pk=post.pk)
+        partial.text = 'Новый текст'
+        with CaptureQueriesContext(connection) as queries:
+            partial.save()
+        [update] = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "posts_post"')
+        ]
+        self.assertNotIn('"group_id"', update)
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Новый текст')
+        self.assertEqual(post.group, group)
+
+    def test_post_copy_with_force_insert(self):
+        """force_insert сохраняет копию загруженного поста"""
+        post = Post.objects.create(author=self.author, text='Текст')
+        post.pk = None
+        post.save(force_insert=True)
+        self.assertEqual(Post.objects.filter(text='Текст').count(), 2)
+
+    def test_counters_rolled_back_with_post(self):
+        """Ошибка обработчика отменяет и пост, и счётчик"""
+        with mock.patch(
+            'posts.signals.timeline.fan_out', side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            Post.objects.create(author=self.author, text='Текст')
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 0
+        )
+
+    def test_reconcile_counters_command(self):
+        """Команда чинит разошедшиеся счётчики"""
+        Post.objects.create(author=self.author, text='Текст')
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1
+        )
+        self.assertTrue(UserStats.objects.filter(user=self.reader).exists())
+
+
+@override_settings(FEED_FANOUT_THRESHOLD=2)
+class SeedTest(TestCase):
+    def test_seed_tiny_dataset(self):
+        """seed_yatube на крошечных размерах: даты в прошлом, ленты без
+        популярных авторов, auto_now_add возвращён"""
+        call_command(
+            'seed_yatube', users=8, groups=2, follows=30, posts=40,
+            comments=20, days=365, stdout=StringIO(),
+        )
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 20)
+        day_ago = timezone.now() - timedelta(days=1)
+        self.assertLess(
+            Post.objects.aggregate(Min('pub_date'))['pub_date__min'],
+            day_ago,
+        )
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+        self.assertTrue(Comment._meta.get_field('created').auto_now_add)
+        celebrities = UserStats.objects.filter(followers_count__gt=2)
+        self.assertTrue(celebrities.exists())
+        expected = Follow.objects.exclude(
+            author__stats__in=celebrities
+        ).aggregate(
+            entries=Count('author__posts')
+        )['entries']
+        self.assertEqual(TimelineEntry.objects.count(), expected)
+        self.assertFalse(TimelineEntry.objects.filter(
+            author__stats__in=celebrities
+        ).exists())
+
+    def test_seed_stage_in_process_pool(self):
+        """Этап вставки раскладывается по пулу процессов"""
+        command = seed_yatube.Command(stdout=StringIO())
+        command.seed = 1
+        seed_yatube._state.update(
+            batch_size=10, prefix='pool', password='', sentences=['Текст'],
+        )
+        # Дочерние процессы не видят тестовую базу в памяти: пишут они
+        # в заглушку, а проверяется разбиение и сбор результатов.
+        with mock.patch.object(seed_yatube, 'TASK_SIZE', 2), \
+                mock.patch.object(QuerySet, 'bulk_create'):
+            command._stage('users', 5, workers=2)
+        self.assertIn('users: 5 строк', command.stdout.getvalue())
@@ -78,6 +78,10 @@ class PostsURLTests(TestCase):
                 'post:post_create',
                 None,
                 '/create/'
+            ), (
+                'posts:post_comments',
+                (self.post.pk,),
+                f'/posts/{self.post.pk}/comments/'
             )
         )
         for name, arg, url in name_args_urls:
@@ -1,16 +1,33 @@
+import json
+import os
 import tempfile
 import shutil
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django import forms
 
-from ..models import Follow, Group, Post, User
+from hashlib import md5
+from http import HTTPStatus
+
+from core.slow_queries import explain
+
+from ..models import Comment, Follow, Group, Post, TimelineEntry, User
+from .. import cache as fragments, page_cache, thumbnails, views
 from ..forms import PostForm
+from ..feed import FeedPaginator, chunk_query
+from ..paginators import CursorPaginator
+from ..urls import urlpatterns
 
 User = get_user_model()
 
@@ -163,16 +180,118 @@ class PostPagesTest(TestCase):
                         self.assertIsInstance(form_field, expected)
 
     def test_index_cache_works(self):
+        """Карточки берутся из кэша до изменения поста"""
         new_post = Post.objects.create(
             text='text',
             author=self.user
         )
+        self.authorized_client.get(reverse('posts:main_page'))
+        Post.objects.filter(pk=new_post.pk).update(text='silent edit')
+        response = self.authorized_client.get(reverse('posts:main_page'))
+        self.assertContains(response, 'text')
+        self.assertNotContains(response, 'silent edit')
+        new_post.text = 'saved edit'
+        new_post.save()
+        response = self.authorized_client.get(reverse('posts:main_page'))
+        self.assertContains(response, 'saved edit')
+
+    def test_index_shows_changes_immediately(self):
+        """Удалённый пост сразу пропадает с главной"""
+        new_post = Post.objects.create(
+            text='short lived',
+            author=self.user
+        )
         response = self.authorized_client.get(reverse('posts:main_page'))
-        content_before = response.content
+        self.assertContains(response, new_post.text)
         new_post.delete()
-        response_2 = self.authorized_client.get(reverse('post:main_page'))
-        content_after = response_2.content
-        self.assertEqual(content_before, content_after)
+        response = self.authorized_client.get(reverse('post:main_page'))
+        self.assertNotContains(response, new_post.text)
+
+    def test_group_rename_invalidates_cards(self):
+        """Переименование группы обновляет карточки"""
+        group = Group.objects.create(title='Old group', slug='old')
+        Post.objects.create(text='text', author=self.user, group=group)
+        self.authorized_client.get(reverse('posts:main_page'))
+        group.title = 'Renamed group'
+        group.save()
+        response = self.authorized_client.get(reverse('posts:main_page'))
+        self.assertContains(response, 'Renamed group')
+
+    def test_thumbnails_resolved_in_one_query(self):
+        """Превью всей страницы ищутся в KV-хранилище одним запросом"""
+        for number in range(3):
+            post = Post.objects.create(
+                author=self.user,
+                text=f'Image post {number}',
+                image=SimpleUploadedFile(
+                    name=f'small{number}.gif',
+                    content=self.small_gif,
+                    content_type='image/gif'
+                )
+            )
+            thumbnails.generate(post.image.name)
+        thumbnails.generate(self.post.image.name)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(reverse('posts:main_page'))
+        kvstore_queries = [
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+        self.assertContains(response, 'card-img', count=4)
+
+    def test_generate_counts_built_thumbnails(self):
+        """generate() и команда считают построенные превью, а не
+        геометрии"""
+        post = Post.objects.create(
+            author=self.user,
+            text='Generated',
+            image=SimpleUploadedFile(
+                name='generated.gif',
+                # Другая палитра: одинаковые картинки хранятся одним файлом.
+                content=self.small_gif.replace(
+                    b'\xFF\xFF\xFF', b'\x00\xFF\x00'
+                ),
+                content_type='image/gif'
+            )
+        )
+        name = post.display_image.name
+        variants = len(thumbnails.geometries())
+        self.assertEqual(thumbnails.generate(name), variants)
+        self.assertEqual(thumbnails.generate(name), 0)
+        self.assertEqual(thumbnails.generate(name, force=True), variants)
+        thumbnails.generate(self.post.display_image.name)
+        out = StringIO()
+        call_command('generate_thumbnails', workers=0, stdout=out)
+        self.assertIn('Готово превью: 0, ошибок: 0', out.getvalue())
+        out = StringIO()
+        call_command('generate_thumbnails', workers=0, progress=0, stdout=out)
+        self.assertNotIn('картинок', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('generate_thumbnails', progress=-1)
+
+    @override_settings(THUMBNAIL_WORKERS=1)
+    def test_shared_pool_recreated_after_shutdown(self):
+        """После shutdown() общий пул создаётся заново"""
+        pool = thumbnails.executor()
+        self.assertIs(thumbnails.executor(), pool)
+        thumbnails.shutdown()
+        self.addCleanup(thumbnails.shutdown)
+        self.assertIsNot(thumbnails.executor(), pool)
+
+    @override_settings(THUMBNAIL_SRCSET_WIDTHS=(320, 640))
+    def test_post_image_srcset(self):
+        """Картинка поста отдаётся набором ширин в srcset"""
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        srcset = response.context['post'].srcset
+        self.assertEqual([width for width, _ in srcset], [320, 640, 960])
+        for width, image in srcset:
+            with self.subTest(width=width):
+                self.assertEqual(image.width, width)
+                self.assertContains(response, f'{image.url} {width}w')
 
     def test_auth_user_can_follow_or_unfollow(self):
         """Работают ли подписки"""
@@ -195,6 +314,17 @@ class PostPagesTest(TestCase):
         )
         self.assertEqual(Follow.objects.count(), follow_count)
 
+    def test_double_follow_creates_one_subscription(self):
+        """Повторная подписка не дублирует запись"""
+        author = User.objects.create(username='test1')
+        for _ in range(2):
+            self.authorized_client.get(
+                reverse('posts:profile_follow', args=(author.username,))
+            )
+        self.assertEqual(
+            Follow.objects.filter(user=self.user, author=author).count(), 1
+        )
+
     def test_new_post_appears_on_right_user(self):
         """Новый пост на нужной странице"""
         user1 = User.objects.create(username='test1')
@@ -228,6 +358,241 @@ class PostPagesTest(TestCase):
                     len(response.context['page_obj'].object_list), num
                 )
 
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        """Подписка подтягивает старые посты, отписка их убирает"""
+        author = User.objects.create(username='test1')
+        Post.objects.create(text='old', author=author)
+        self.authorized_client.get(
+            reverse('posts:profile_follow', args=(author.username,))
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 1)
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow', args=(author.username,))
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_rebuild_timeline_command(self):
+        """Команда восстанавливает ленту после порчи"""
+        author = User.objects.create(username='test1')
+        Follow.objects.create(user=self.user, author=author)
+        Post.objects.create(text='test', author=author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timeline', stdout=StringIO())
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user).exists()
+        )
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_feed_merges_pulled_and_pushed_posts(self):
+        """Посты популярных авторов подтягиваются при чтении"""
+        star = User.objects.create(username='star')
+        author = User.objects.create(username='author')
+        fan = User.objects.create(username='fan')
+        Follow.objects.create(user=fan, author=star)
+        Follow.objects.create(user=self.user, author=star)
+        Follow.objects.create(user=self.user, author=author)
+        cache.clear()
+        posts = [
+            Post.objects.create(text=str(number), author=user)
+            for number, user in enumerate((star, author, star, author))
+        ]
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=star).exists()
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']), posts[::-1]
+        )
+        with self.settings(PAGE_NUMBER=3):
+            first = self.authorized_client.get(
+                reverse('posts:follow_index')
+            ).context['page_obj']
+            second = self.authorized_client.get(
+                reverse('posts:follow_index'), {'after': first.next_cursor}
+            ).context['page_obj']
+        self.assertEqual(list(first) + list(second), posts[::-1])
+        self.assertFalse(second.has_next())
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_feed_reads_celebrities_in_one_stream(self):
+        """Число запросов ленты не растёт с числом популярных авторов"""
+        fan = User.objects.create(username='fan')
+        for number in range(6):
+            star = User.objects.create(username=f'star{number}')
+            Follow.objects.create(user=fan, author=star)
+            Follow.objects.create(user=self.user, author=star)
+            Post.objects.create(text=str(number), author=star)
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.context['page_obj']), 6)
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_feed_pages_celebrities_by_author_index(self):
+        """Популярные авторы читаются по индексу каждого автора, а страницы
+        по курсору идут в общем порядке"""
+        fan = User.objects.create(username='fan')
+        stars = [User.objects.create(username=f'star{n}') for n in range(3)]
+        for star in stars:
+            Follow.objects.create(user=fan, author=star)
+            Follow.objects.create(user=self.user, author=star)
+        for number in range(12):
+            Post.objects.create(text=str(number), author=stars[number % 3])
+        expected = list(Post.objects.filter(author__in=stars))
+        paginator = FeedPaginator(self.user, 5)
+        queryset, fields, authors = paginator.sources[-1]
+        sql, params = chunk_query(
+            queryset, fields, None, True, 6, authors
+        ).query.sql_with_params()
+        plan = explain(connection, sql, params)
+        self.assertEqual(plan.count('post_author_date_idx'), len(stars))
+        pages, cursor = [], None
+        while True:
+            page = paginator.get_cursor_page(after=cursor)
+            pages.extend(page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(pages, expected)
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_explain_views_checks_feed_queries(self):
+        """explain_views разбирает запросы, которые выполняет лента"""
+        fan = User.objects.create(username='fan')
+        star = User.objects.create(username='star')
+        Follow.objects.create(user=fan, author=star)
+        Follow.objects.create(user=self.user, author=star)
+        Post.objects.create(text='star post', author=star)
+        out = StringIO()
+        call_command('explain_views', stdout=out)
+        output = out.getvalue()
+        self.assertIn('follow_index: популярные авторы (1)', output)
+        self.assertIn('post_author_date_idx', output)
+        self.assertIn('Все запросы читают индекс в нужном порядке', output)
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_author_crossing_threshold_keeps_feed(self):
+        """Автор, ставший популярным и переставший им быть, не пропадает
+        из лент"""
+        author = User.objects.create(username='author')
+        fan = User.objects.create(username='fan')
+        old = Post.objects.create(text='old', author=author)
+        Follow.objects.create(user=self.user, author=author)
+        self.assertEqual(
+            TimelineEntry.objects.filter(author=author).count(), 1
+        )
+        follow = Follow.objects.create(user=fan, author=author)
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=author).exists()
+        )
+        new = Post.objects.create(text='new', author=author)
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [new, old])
+        follow.delete()
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(author=author).values_list(
+                'user', 'post'
+            )),
+            {(self.user.pk, old.pk), (self.user.pk, new.pk)},
+        )
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [new, old])
+
+    def test_conditional_get(self):
+        """Неизменившиеся страницы отдаются как 304"""
+        names_args = (
+            ('posts:main_page', None),
+            ('posts:group_posts_page', (self.group.slug,)),
+            ('posts:profile', (self.user.username,)),
+            ('posts:post_detail', (self.post.pk,)),
+        )
+        for name, arg in names_args:
+            with self.subTest(name=name):
+                url = reverse(name, args=arg)
+                etag = self.authorized_client.get(url)['ETag']
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED
+                )
+                self.post.save()
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_comment_changes_post_detail_etag(self):
+        """Новый комментарий меняет ETag страницы поста"""
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        etag = self.client.get(url)['ETag']
+        self.authorized_client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'comment'}
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_stale_page_served_while_recomputing(self):
+        """Пока страницу пересчитывает другой запрос, отдаётся копия"""
+        url = reverse('posts:main_page')
+        self.client.get(url)
+        new_post = Post.objects.create(text='fresh post', author=self.user)
+        key = f'page_cache:index_page:{md5(url.encode()).hexdigest()}'
+        cache.add(f'{key}:lock', 1)
+        stale_before = page_cache.STATS['index_page:stale']
+        response = self.client.get(url)
+        self.assertNotContains(response, new_post.text)
+        self.assertEqual(
+            page_cache.STATS['index_page:stale'], stale_before + 1
+        )
+        cache.delete(f'{key}:lock')
+        self.assertContains(self.client.get(url), new_post.text)
+
+    def test_stale_page_keeps_its_etag(self):
+        """Устаревшая копия отдаётся со своим ETag и не подтверждается
+        ETag новой версии"""
+        url = reverse('posts:main_page')
+        old_etag = self.client.get(url)['ETag']
+        Post.objects.create(text='fresh post', author=self.user)
+        key = f'page_cache:index_page:{md5(url.encode()).hexdigest()}'
+        cache.add(f'{key}:lock', 1)
+        stale = self.client.get(url)
+        self.assertNotContains(stale, 'fresh post')
+        self.assertEqual(stale['ETag'], old_etag)
+        cache.delete(f'{key}:lock')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=stale['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'fresh post')
+
+    def test_recompute_keeps_foreign_lock(self):
+        """Пересчёт не снимает блокировку, взятую другим запросом"""
+        url = reverse('posts:main_page')
+        key = f'page_cache:index_page:{md5(url.encode()).hexdigest()}'
+        paginate = views.paginator_func
+
+        def slow_paginate(*args):
+            # Пока страница считается, блокировка истекла и её взял
+            # другой запрос.
+            cache.set(f'{key}:lock', 'foreign')
+            return paginate(*args)
+
+        with mock.patch.object(views, 'paginator_func', slow_paginate):
+            self.client.get(url)
+        self.assertEqual(cache.get(f'{key}:lock'), 'foreign')
+
+    def test_authenticated_pages_not_cached(self):
+        """Страницы вошедших пользователей не кэшируются"""
+        url = reverse('posts:main_page')
+        recompute = page_cache.STATS['index_page:recompute']
+        self.authorized_client.get(url)
+        self.assertEqual(
+            page_cache.STATS['index_page:recompute'], recompute
+        )
+        key = f'page_cache:index_page:{md5(url.encode()).hexdigest()}'
+        self.assertIsNone(cache.get(key))
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -247,6 +612,7 @@ class PaginatorViewsTest(TestCase):
             )
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
 
@@ -271,3 +637,219 @@ class PaginatorViewsTest(TestCase):
                         self.assertEqual(
                             len(response.context['page_obj']), posts
                         )
+
+    def test_cursor_pages(self):
+        """Переход по курсорам вперёд и назад"""
+        url = reverse('posts:main_page')
+        first = self.authorized_client.get(url).context['page_obj']
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+        second = self.authorized_client.get(
+            url, {'after': first.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(
+            len(second), settings.POSTS_NUMBER - settings.PAGE_NUMBER
+        )
+        self.assertFalse(second.has_next())
+        self.assertTrue(second.has_previous())
+        back = self.authorized_client.get(
+            url, {'before': second.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(back), list(first))
+        last = self.authorized_client.get(
+            url, {'last': ''}
+        ).context['page_obj']
+        self.assertEqual(len(last), settings.PAGE_NUMBER)
+        self.assertEqual(last[len(last) - 1], second[len(second) - 1])
+        self.assertFalse(last.has_next())
+        self.assertTrue(last.has_previous())
+
+    def test_cursor_page_without_number(self):
+        """Страница по курсору читается одним запросом и не даёт
+        номерных методов"""
+        paginator = CursorPaginator(
+            Post.objects.all(), settings.PAGE_NUMBER
+        )
+        with self.assertNumQueries(1):
+            page = paginator.get_cursor_page()
+            self.assertTrue(page.has_next())
+            self.assertEqual(page.object_list.count(), settings.PAGE_NUMBER)
+        with self.assertNumQueries(1):
+            last = paginator.get_cursor_page(last=True)
+            self.assertTrue(last.has_previous())
+        self.assertEqual(
+            repr(page), f'<Page of {settings.PAGE_NUMBER} objects by cursor>'
+        )
+        for method in (page.start_index, page.end_index,
+                       page.next_page_number):
+            with self.subTest(method=method.__name__):
+                with self.assertRaises(TypeError):
+                    method()
+
+    def test_cursor_links_keep_query(self):
+        """Ссылки на соседние страницы сохраняют прочие параметры"""
+        url = reverse('posts:main_page')
+        first = self.authorized_client.get(url, {'view': 'compact'})
+        cursor = first.context['page_obj'].next_cursor
+        self.assertContains(
+            first, f'href="?view=compact&amp;after={cursor}"'
+        )
+        second = self.authorized_client.get(
+            url, {'view': 'compact', 'after': cursor}
+        )
+        self.assertContains(second, 'href="?view=compact"')
+        self.assertNotContains(second, 'after=' + cursor)
+
+    def test_broken_cursor_gives_first_page(self):
+        """Битый курсор ведёт на первую страницу"""
+        response = self.authorized_client.get(
+            reverse('posts:main_page'), {'after': 'broken'}
+        )
+        self.assertEqual(
+            len(response.context['page_obj']), settings.PAGE_NUMBER
+        )
+
+
+@override_settings(COMMENTS_PAGE_NUMBER=3)
+class CommentsViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester')
+        cls.post = Post.objects.create(author=cls.user, text='Test text')
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Comment {number}'
+            )
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_detail_shows_first_comments(self):
+        """На странице поста только первая порция комментариев"""
+        response = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        comments = response.context['comments']
+        self.assertEqual(list(comments), self.comments[:3])
+        self.assertTrue(comments.has_next())
+
+    def test_load_more_fragment(self):
+        """Фрагмент «Показать ещё» отдаёт следующую порцию"""
+        first = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        ).context['comments']
+        response = self.client.get(
+            reverse('posts:post_comments', args=(self.post.pk,)),
+            {'after': first.next_cursor}
+        )
+        self.assertTemplateUsed(response, 'posts/includes/comment_list.html')
+        self.assertEqual(list(response.context['comments']), self.comments[3:])
+        self.assertFalse(response.context['comments'].has_next())
+
+    def test_comments_of_missing_post(self):
+        """Комментарии несуществующего поста — 404"""
+        response = self.client.get(reverse('posts:post_comments', args=(0,)))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class SearchViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Ёжик в тумане <script>'
+        )
+        Post.objects.create(author=cls.user, text='Совсем про другое')
+
+    def search(self, query, **params):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+
+    def test_search_finds_and_highlights(self):
+        """Поиск находит пост по слову и подсвечивает совпадение"""
+        response = self.search('ежик туман')
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), [self.post])
+        self.assertContains(response, '<mark>Ежик</mark>')
+        self.assertContains(response, '&lt;script&gt;')
+        self.assertNotContains(response, '<script>')
+
+    def test_search_index_follows_changes(self):
+        """Правка и удаление поста сразу видны в поиске"""
+        self.post.text = 'Медвежонок'
+        self.post.save()
+        self.assertFalse(self.search('ежик').context['page_obj'])
+        self.assertTrue(self.search('медвежонок').context['page_obj'])
+        self.post.delete()
+        self.assertFalse(self.search('медвежонок').context['page_obj'])
+
+    @override_settings(PAGE_NUMBER=2)
+    def test_search_pages_keep_query(self):
+        """Ссылки на страницы результатов сохраняют запрос"""
+        for number in range(3):
+            Post.objects.create(author=self.user, text=f'Туман {number}')
+        response = self.search('туман', page=2)
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['page_obj']), 2)
+        self.assertContains(
+            response, '?q=%D1%82%D1%83%D0%BC%D0%B0%D0%BD&page=1'
+        )
+
+
+class BenchViewsTest(TestCase):
+    def test_bench_views_tiny_dataset(self):
+        """bench_views на крошечной базе замеряет все страницы posts
+        и сравнивает отчёт с прошлым"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        report = os.path.join(directory, 'bench_views.json')
+        out = StringIO()
+        # Тестовую базу уже создал запуск тестов.
+        with mock.patch.object(connection.creation, 'create_test_db'), \
+                mock.patch.object(connection.creation, 'destroy_test_db'):
+            call_command(
+                'bench_views', users=5, groups=2, follows=10, posts=20,
+                comments=20, requests=1, warmup=0, output=report,
+                stdout=out, stderr=StringIO(),
+            )
+            call_command(
+                'bench_views', users=5, groups=2, follows=10, posts=20,
+                comments=20, requests=1, warmup=0, keepdb=True,
+                output=os.path.join(directory, 'again.json'),
+                compare=report, threshold=1000, stdout=out,
+            )
+        with open(report) as source:
+            routes = json.load(source)['routes']
+        self.assertEqual(
+            {pattern.name for pattern in urlpatterns}, set(routes)
+        )
+        for name, row in routes.items():
+            with self.subTest(name=name):
+                self.assertLess(row['status'], 400)
+                self.assertGreater(row['queries'], 0)
+        self.assertIn('Регрессий нет', out.getvalue())
+
+
+class CardCacheCommitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author')
+        self.post = Post.objects.create(author=self.user, text='old text')
+
+    def test_card_read_before_commit_not_kept(self):
+        """Карточка, отрисованная по старой строке до коммита правки,
+        после коммита не отдаётся"""
+        stale = Post.objects.get(pk=self.post.pk)
+        with transaction.atomic():
+            self.post.text = 'new text'
+            self.post.save()
+            # Параллельный запрос ещё видит старую строку.
+            fragments.render_cards([stale])
+        fresh = Post.objects.select_related('author', 'group').get(
+            pk=self.post.pk
+        )
+        [card] = fragments.render_cards([fresh])
+        self.assertIn('new text', card)
@@ -0,0 +1,229 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as BaseKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core import instrumentation
+from core.query_budget import unbudgeted
+
+from .storage import content_storage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _init_worker():
+    # Соединения с базой достались от родителя через fork: каждому
+    # процессу нужны свои.
+    connections.close_all()
+
+
+def card_width():
+    return int(settings.THUMBNAIL_GEOMETRIES[0][0].split('x')[0])
+
+
+def card_variants():
+    """Варианты превью карточки для srcset: (ширина, геометрия, параметры).
+
+    Карточка — первая из THUMBNAIL_GEOMETRIES, остальные ширины берутся
+    из THUMBNAIL_SRCSET_WIDTHS с теми же пропорциями и параметрами.
+    """
+    geometry, options = settings.THUMBNAIL_GEOMETRIES[0]
+    width, height = map(int, geometry.split('x'))
+    widths = sorted({width, *settings.THUMBNAIL_SRCSET_WIDTHS})
+    return [
+        (variant, f'{variant}x{round(height * variant / width)}', options)
+        for variant in widths
+    ]
+
+
+def geometries():
+    """Все превью, которые строятся для картинки заранее."""
+    result = list(settings.THUMBNAIL_GEOMETRIES)
+    for _, geometry, options in card_variants():
+        if (geometry, options) not in result:
+            result.append((geometry, options))
+    return result
+
+
+def generate(name, force=False):
+    """Строит все превью картинки одним проходом и кладёт их в
+    KV-хранилище.
+
+    Возвращает число построенных превью. Уже построенные sorl не
+    пересчитывает, если не задан force.
+    """
+    source = ImageFile(name, content_storage)
+    if force:
+        default.kvstore.delete_thumbnails(source)
+    created = 0
+    for geometry, options in geometries():
+        thumbnail = thumbnail_file(name, geometry, options)
+        if not (default.kvstore.get(thumbnail) or thumbnail.exists()):
+            created += 1
+        get_thumbnail(source, geometry, **options)
+    return created
+
+
+def pool(workers):
+    """Новый пул процессов для превью."""
+    return ProcessPoolExecutor(workers, initializer=_init_worker)
+
+
+def executor():
+    """Пул процессов для превью, общий для всего процесса Django."""
+    global _executor
+    if _executor is None:
+        _executor = pool(settings.THUMBNAIL_WORKERS)
+    return _executor
+
+
+def shutdown(wait=True):
+    """Останавливает общий пул; следующий submit() создаст новый."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait)
+        _executor = None
+
+
+def _report(future):
+    error = future.exception()
+    if error is not None:
+        logger.error('Thumbnail generation failed', exc_info=error)
+
+
+def submit(name):
+    if not settings.THUMBNAIL_WORKERS:
+        try:
+            generate(name)
+        except Exception:
+            logger.exception('Thumbnail generation failed')
+        return
+    executor().submit(generate, name).add_done_callback(_report)
+
+
+def schedule(post):
+    """Ставит картинку поста в очередь после фиксации транзакции.
+
+    Первый читатель получает уже готовые превью, а не ждёт их
+    построения внутри запроса.
+    """
+    if post.display_image:
+        name = post.display_image.name
+        transaction.on_commit(lambda: submit(name))
+
+
+class KVStore(BaseKVStore):
+    """KV-хранилище sorl, которое умеет читать пачкой.
+
+    Сначала один get_many из кэша, затем для промахов один запрос к
+    таблице sorl; отсутствующие ключи тоже кэшируются.
+    """
+
+    def get_many(self, image_files):
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        values = self.cache.get_many(keys)
+        missing = keys.keys() - values.keys()
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(key__in=missing)
+                .values_list('key', 'value')
+            )
+            for key in missing:
+                found.setdefault(key, EMPTY_VALUE)
+            self.cache.set_many(
+                found, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+            )
+            values.update(found)
+        return {
+            keys[key]: deserialize_image_file(value)
+            for key, value in values.items()
+            if value and value != EMPTY_VALUE
+        }
+
+
+def thumbnail_file(name, geometry, options):
+    """Файл превью, который построил бы {% thumbnail %}, без обращения
+    к хранилищу. Параметры дополняются так же, как в бэкенде sorl."""
+    source = ImageFile(name, content_storage)
+    options = dict(options)
+    backend = default.backend
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(thumbnail_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry, options),
+        default.storage,
+    )
+
+
+def attach(posts):
+    """Находит все варианты превью карточек страницы за один проход по
+    KV-хранилищу.
+
+    Кладёт в post.srcset пары (ширина, превью), а в post.thumbnail —
+    превью основной ширины. Превью, которых ещё нет, равны None, их
+    достраивает тег {% post_image %}.
+    """
+    with instrumentation.timed('thumb'):
+        _attach(posts, card_variants())
+
+
+def _attach(posts, variants):
+    files = {
+        post.pk: [
+            (width, thumbnail_file(
+                post.display_image.name, geometry, options
+            ))
+            for width, geometry, options in variants
+        ]
+        for post in posts if post.display_image
+    }
+    wanted = [
+        image_file for pairs in files.values() for _, image_file in pairs
+    ]
+    kvstore = default.kvstore
+    if hasattr(kvstore, 'get_many'):
+        found = kvstore.get_many(wanted)
+    else:
+        found = {
+            image_file.key: kvstore.get(image_file) for image_file in wanted
+        }
+    for post in posts:
+        post.srcset = [
+            (width, found.get(image_file.key))
+            for width, image_file in files.get(post.pk, ())
+        ]
+        post.thumbnail = dict(post.srcset).get(card_width())
+
+
+def complete(post):
+    """Достраивает превью, которых не нашлось в attach()."""
+    if not hasattr(post, 'srcset'):
+        attach([post])
+    source = ImageFile(post.display_image.name, content_storage)
+    # Обычно превью строит пул заранее; здесь только запасной путь.
+    with unbudgeted(), instrumentation.timed('thumb'):
+        post.srcset = [
+            (width, image or get_thumbnail(source, geometry, **options))
+            for (width, image), (_, geometry, options)
+            in zip(post.srcset, card_variants())
+        ]
+    post.thumbnail = dict(post.srcset)[card_width()]
+    return post.srcset
@@ -0,0 +1,134 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .feed import reset_celebrities
+from .models import Follow, Post, TimelineEntry, UserStats
+
+BATCH_SIZE = 500
+
+
+def _entry(user_id, post):
+    return TimelineEntry(
+        user_id=user_id,
+        post_id=post.pk,
+        author_id=post.author_id,
+        pub_date=post.pub_date,
+    )
+
+
+def _insert(entries):
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, BATCH_SIZE))
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _insert(_entry(user_id, post) for user_id in followers.iterator())
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя все посты нового автора."""
+    posts = Post.objects.filter(author_id=author_id).only(
+        'pk', 'author_id', 'pub_date'
+    )
+    _insert(_entry(user_id, post) for post in posts.iterator())
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты читателя посты автора, от которого он отписался."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def restore(author_id):
+    """Раскладывает все посты автора по лентам его подписчиков.
+
+    Одним INSERT ... SELECT; записи, которые уже есть, не дублируются.
+    """
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, post_id, author_id, pub_date) '
+            'SELECT follow.user_id, post.id, post.author_id, post.pub_date '
+            f'FROM {Follow._meta.db_table} follow '
+            f'JOIN {Post._meta.db_table} post '
+            'ON post.author_id = follow.author_id '
+            'WHERE follow.author_id = %s AND NOT EXISTS ('
+            f'SELECT 1 FROM {table} entry '
+            'WHERE entry.user_id = follow.user_id '
+            'AND entry.post_id = post.id)',
+            [author_id],
+        )
+
+
+def reclassify(author_id, followers, delta):
+    """Переводит автора между рассылкой и подтягиванием при чтении,
+    когда число подписчиков пересекает FEED_FANOUT_THRESHOLD.
+
+    Ставший популярным автор убирается из лент: его посты теперь
+    читаются из его индекса. Переставшему быть популярным ленты
+    подписчиков дополняются постами, которые мимо них не разносились.
+    """
+    threshold = settings.FEED_FANOUT_THRESHOLD
+    if delta > 0 and followers - delta <= threshold < followers:
+        TimelineEntry.objects.filter(author_id=author_id).delete()
+    elif delta < 0 and followers <= threshold < followers - delta:
+        restore(author_id)
+    else:
+        return
+    # Другой процесс мог закэшировать список до коммита.
+    reset_celebrities()
+    transaction.on_commit(reset_celebrities)
+
+
+def _in(column, values):
+    placeholders = ', '.join(['%s'] * len(values))
+    return f'{column} IN ({placeholders})', list(values)
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """Пересобирает ленты с нуля по таблице подписок.
+
+    Записи строятся одним INSERT ... SELECT в базе, без выгрузки
+    подписок в Python. Посты популярных авторов в ленты не кладутся,
+    их подтягивает FeedPaginator.
+    """
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+    conditions = []
+    if user_ids is not None:
+        if not user_ids:
+            return 0
+        conditions.append(_in('follow.user_id', user_ids))
+    # Популярные авторы — подзапросом: их может быть больше, чем
+    # параметров, которые база принимает в одном запросе.
+    conditions.append((
+        'follow.author_id NOT IN (SELECT user_id '
+        f'FROM {UserStats._meta.db_table} WHERE followers_count > %s)',
+        [settings.FEED_FANOUT_THRESHOLD],
+    ))
+    where = 'WHERE ' + ' AND '.join(sql for sql, _ in conditions)
+    params = [value for _, values in conditions for value in values]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TimelineEntry._meta.db_table} '
+            '(user_id, post_id, author_id, pub_date) '
+            'SELECT follow.user_id, post.id, post.author_id, post.pub_date '
+            f'FROM {Follow._meta.db_table} follow '
+            f'JOIN {Post._meta.db_table} post '
+            'ON post.author_id = follow.author_id '
+            f'{where}',
+            params,
+        )
+    return entries.count()
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.files.uploadhandler import (SkipFile,
+                                             TemporaryFileUploadHandler)
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+from core import metrics
+
+
+def upload_errors(request):
+    """Ошибки загрузки, найденные обработчиком: {поле формы: сообщение}."""
+    request.FILES  # Тело запроса разбирается при первом обращении.
+    return getattr(request, 'upload_errors', {})
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загрузку во временный файл по кускам и отбрасывает её,
+    не дожидаясь конца, если она слишком велика.
+
+    Размер в байтах считается по мере поступления, размер в пикселях
+    читается из заголовка картинки, как только тот пришёл целиком, так
+    что до полного декодирования доходят только допустимые файлы.
+    Отброшенное поле формы получает ошибку через upload_errors().
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.checked = False
+
+    def reject(self, message):
+        metrics.UPLOADS.observe(self.received, result='rejected')
+        if self.request is not None:
+            if not hasattr(self.request, 'upload_errors'):
+                self.request.upload_errors = {}
+            self.request.upload_errors[self.field_name] = message
+        self.file.close()
+        raise SkipFile(message)
+
+    def check_header(self):
+        self.file.flush()
+        try:
+            with Image.open(self.file.temporary_file_path()) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            width = height = float('inf')
+        except Exception:
+            # Заголовок ещё не дошёл или это не картинка: в последнем
+            # случае файл отвергнет проверка ImageField.
+            if self.received < settings.IMAGE_UPLOAD_HEADER_BYTES:
+                return
+            width = height = 0
+        self.checked = True
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.reject(
+                'Картинка больше {} мегапикселей.'.format(
+                    settings.IMAGE_UPLOAD_MAX_PIXELS // 10 ** 6
+                )
+            )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.reject('Файл больше {}.'.format(
+                filesizeformat(settings.IMAGE_UPLOAD_MAX_BYTES)
+            ))
+        super().receive_data_chunk(raw_data, start)
+        if not self.checked:
+            self.check_header()
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            self.check_header()
+        metrics.UPLOADS.observe(file_size, result='accepted')
+        return super().file_complete(file_size)
@@ -1,8 +1,22 @@
 from django.conf import settings
-from django.core.paginator import Paginator
 
+from .paginators import CursorPaginator
 
-def paginator_func(request, posts_list):
-    paginator = Paginator(posts_list, settings.PAGE_NUMBER)
+
+def cursor_page(request, paginator):
+    return paginator.get_cursor_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        last='last' in request.GET,
+    )
+
+
+def paginator_func(request, posts_list, ordering=('-pub_date', '-pk')):
+    paginator = CursorPaginator(
+        posts_list, settings.PAGE_NUMBER, ordering=ordering
+    )
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None:
+        # Старые ссылки вида ?page=N продолжают работать через OFFSET.
+        return paginator.get_page(page_number)
+    return cursor_page(request, paginator)
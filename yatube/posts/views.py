@@ -1,13 +1,26 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
 
+from core.query_budget import query_budget
+
+from .comments import comment_page
+from .conditional import (group_scope, index_scope, page_condition,
+                          post_scope, profile_scope)
+from .feed import FeedPaginator
 from .forms import PostForm, CommentForm
-from .models import Comment, Follow, Group, Post, User
-from .utils import paginator_func
+from .models import Follow, Group, Post, User
+from .page_cache import cached_page
+from .search import SearchResults
+from .uploads import upload_errors
+from .utils import cursor_page, paginator_func
 
 
-@cache_page(20, key_prefix='index_page')
+@query_budget(7)
+@page_condition(index_scope)
+@cached_page(index_scope, key_prefix='index_page')
 def index(request):
     posts_list = Post.objects.select_related('author', 'group').all()
     page_obj = paginator_func(request, posts_list)
@@ -17,6 +30,9 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(8)
+@page_condition(group_scope)
+@cached_page(group_scope, key_prefix='group_page')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts_list = group.posts.select_related('author').all()
@@ -28,26 +44,33 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(10)
+@page_condition(profile_scope)
+@cached_page(profile_scope, key_prefix='profile_page')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
     author_posts = author.posts.select_related('group')
     page_obj = paginator_func(request, author_posts)
     context = {
         'author': author,
         'page_obj': page_obj
     }
-    if Follow.objects.filter(
-        user=request.user
-    ).filter(
-        author=author
+    if request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=author
     ).exists():
         context['following'] = True
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(9)
+@page_condition(post_scope)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    comments = Comment.objects.select_related('post').filter(post=post)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id
+    )
+    comments = comment_page(request, post.pk)
     form = CommentForm()
     context = {
         'post': post,
@@ -57,9 +80,39 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(6)
+def post_comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    context = {
+        'post_id': post_id,
+        'comments': comment_page(request, post_id)
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
+@query_budget(6)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        paginator = Paginator(SearchResults(query), settings.PAGE_NUMBER)
+        page_obj = paginator.get_page(request.GET.get('page'))
+    context = {
+        'query': query,
+        'page_obj': page_obj
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@query_budget(25)
 @login_required
 def post_create(request):
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(
+        request.POST or None,
+        files=request.FILES or None,
+        upload_errors=upload_errors(request)
+    )
     if not form.is_valid():
         return render(request, 'posts/create_post.html', {'form': form})
     post = form.save(False)
@@ -68,6 +121,7 @@ def post_create(request):
     return redirect('posts:profile', username=request.user.username)
 
 
+@query_budget(30)
 @login_required
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -76,7 +130,8 @@ def post_edit(request, post_id):
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
-        instance=post
+        instance=post,
+        upload_errors=upload_errors(request)
     )
     if not form.is_valid():
         return render(request, 'posts/create_post.html', {'form': form})
@@ -84,6 +139,7 @@ def post_edit(request, post_id):
     return redirect('posts:post_detail', post_id=post.pk)
 
 
+@query_budget(10)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -96,31 +152,29 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(8)
 @login_required
 def follow_index(request):
-    following = Follow.objects.filter(user=request.user)
-    authors = []
-    for author in following:
-        authors.append(author.author)
-    posts_list = Post.objects.filter(
-        author__in=authors
+    page_obj = cursor_page(
+        request, FeedPaginator(request.user, settings.PAGE_NUMBER)
     )
-    page_obj = paginator_func(request, posts_list)
     context = {
         'page_obj': page_obj
     }
     return render(request, 'posts/follow.html', context)
 
 
+@query_budget(25)
 @login_required
 def profile_follow(request, username):
-    Follow.objects.create(
+    Follow.objects.get_or_create(
         user=request.user,
         author=User.objects.get(username=username)
     )
     return redirect('posts:profile', username=username)
 
 
+@query_budget(20)
 @login_required
 def profile_unfollow(request, username):
     Follow.objects.get(
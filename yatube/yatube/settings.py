@@ -28,6 +28,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
+    'core.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -35,6 +38,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.query_budget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -42,7 +46,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.instrumentation.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -59,6 +63,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+TEST_RUNNER = 'core.testing.TestRunner'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -101,6 +107,126 @@ PAGE_NUMBER = 10
 
 POSTS_NUMBER = 13
 
+COMMENTS_PAGE_NUMBER = 20
+
+# Посты авторов с бо́льшим числом подписчиков не раскладываются по лентам
+# при публикации, а подтягиваются при чтении «Избранных авторов».
+FEED_FANOUT_THRESHOLD = 1000
+
+FEED_CELEBRITIES_TIMEOUT = 60
+
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Сколько секунд страница считается свежей, сколько ещё её можно отдавать,
+# пока другой запрос её пересчитывает, и сколько живёт блокировка пересчёта.
+PAGE_CACHE_TIMEOUT = 20
+
+PAGE_CACHE_GRACE = 10
+
+PAGE_CACHE_LOCK_TIMEOUT = 10
+
+# Превью, которые строятся заранее при сохранении поста. Первое — превью
+# карточки, из него же получаются варианты для srcset шириной из
+# THUMBNAIL_SRCSET_WIDTHS. При THUMBNAIL_WORKERS = 0 превью строятся
+# в том же процессе.
+THUMBNAIL_GEOMETRIES = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+
+THUMBNAIL_SRCSET_WIDTHS = (480, 960, 1440)
+
+THUMBNAIL_WORKERS = 2
+
+THUMBNAIL_KVSTORE = 'posts.thumbnails.KVStore'
+
+# Копия загруженной картинки для показа: большая сторона не длиннее
+# IMAGE_MAX_SIDE, формат — первый из списка, который поддерживает Pillow.
+IMAGE_MAX_SIDE = 2048
+
+IMAGE_WEB_FORMATS = ('AVIF', 'WEBP', 'JPEG')
+
+IMAGE_WEB_QUALITY = 80
+
+# Загрузки пишутся во временный файл по кускам; слишком большие файлы и
+# картинки отбрасываются по счётчику байт и заголовку, до декодирования.
+FILE_UPLOAD_HANDLERS = ('posts.uploads.ImageUploadHandler',)
+
+IMAGE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+
+IMAGE_UPLOAD_MAX_PIXELS = 50 * 10 ** 6
+
+IMAGE_UPLOAD_HEADER_BYTES = 256 * 1024
+
+# Дальше этой границы списки в админке не пересчитывают строки точно.
+ESTIMATED_COUNT_LIMIT = 10000
+
+# В разработке и тестах превышение бюджета — исключение, в продакшене
+# — только запись в лог.
+QUERY_BUDGET_STRICT = DEBUG
+
+# Со скольких одинаковых SELECT за запрос считать их N+1.
+QUERY_BUDGET_REPEATS = 5
+
+# Строка с временами каждого запроса в логе core.instrumentation.
+# В разработке их видно в заголовке Server-Timing.
+REQUEST_LOG = not DEBUG
+
+# Файлы метрик процессов; /metrics/ складывает их вместе.
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+
+METRICS_FLUSH_INTERVAL = 5
+
+# Выборочное профилирование запросов; профили собирает merge_profiles.
+PROFILING_ENABLED = False
+
+PROFILING_SAMPLE_RATE = 0.01
+
+PROFILING_SLOW_MS = 500
+
+PROFILING_INTERVAL = 0.005
+
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Запросы дольше этого пишутся в лог с планом; None — выключено.
+SLOW_QUERY_MS = 200
+
+# За сколько секунд /slow-queries/ показывает сводку.
+SLOW_QUERY_WINDOW = 60 * 60
+
+SLOW_QUERY_DIR = os.path.join(BASE_DIR, 'slow_queries')
+
+SLOW_QUERY_FLUSH_INTERVAL = 5
+
+# У запросов к этим таблицам в лог попадают только типы и длины
+# параметров: там ключи сессий и данные учётных записей.
+SLOW_QUERY_REDACTED_TABLES = ('django_session', 'auth_user')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+        },
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'posts': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 LOGIN_URL = 'users:login'
 
 LOGIN_REDIRECT_URL = 'posts:main_page'
@@ -117,6 +243,19 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TieredCache',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+            'STABLE_NAMESPACES': ('post_card', 'page_cache'),
+            # Общий для всех процессов уровень; на нескольких машинах —
+            # django.core.cache.backends.memcached.MemcachedCache.
+            'L2': {
+                'BACKEND': 'core.cache.FileBasedCache',
+                'LOCATION': os.path.join(BASE_DIR, 'cache'),
+                'OPTIONS': {'MAX_ENTRIES': 10000},
+            },
+        },
     }
 }